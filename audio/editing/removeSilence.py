@@ -1,10 +1,144 @@
 import os
+import sys
 import argparse
 from pathlib import Path
-from pydub import AudioSegment
-from pydub.silence import detect_nonsilent
+import numpy as np
 
-def remove_silence_from_audio(input_file, output_file, min_silence_len=2000, silence_thresh=-50):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from wav_mmap import WavFile, WavWriter, pcm_to_float, float_to_pcm
+
+# Milliseconds of audio squared and summed per step, so no step holds more
+# than a few MB of float64 whatever the file length
+ENERGY_BLOCK_MS = 10000
+
+# Frames copied to the output per write
+WRITE_BLOCK_FRAMES = 1 << 20
+
+def ms_boundaries(frame_rate, duration_ms):
+    """
+    First frame of every millisecond 0..duration_ms, truncated the way pydub slices.
+    """
+    return (np.arange(duration_ms + 1) * (frame_rate / 1000.0)).astype(np.int64)
+
+def ms_energy(wav, bounds):
+    """
+    Sum of squared samples in each millisecond.
+    
+    Args:
+        wav (WavFile): Memory-mapped input
+        bounds (ndarray): Frame boundaries from ms_boundaries
+    
+    Milliseconds past the end of the data count as silence. Work is done
+    ENERGY_BLOCK_MS at a time.
+    """
+    clipped = np.minimum(bounds, len(wav))
+    energy = np.empty(len(bounds) - 1)
+    for block_start in range(0, len(energy), ENERGY_BLOCK_MS):
+        block_end = min(block_start + ENERGY_BLOCK_MS, len(energy))
+        first = clipped[block_start]
+        squares = wav.read(first, clipped[block_end])
+        squares *= squares
+        totals = np.concatenate(([0.0], np.cumsum(squares.sum(axis=1))))
+        edges = clipped[block_start:block_end + 1] - first
+        energy[block_start:block_end] = totals[edges[1:]] - totals[edges[:-1]]
+    return energy
+
+def detect_nonsilent_ranges(energy, bounds, frame_count, channels, full_scale, min_silence_len=2000,
+                            silence_thresh=-50):
+    """
+    Vectorised equivalent of pydub.silence.detect_nonsilent (seek_step=1).
+    
+    Args:
+        energy (ndarray): Per-millisecond sums of squares from ms_energy
+        bounds (ndarray): Frame boundaries from ms_boundaries
+        frame_count (int): Frames of audio data
+        channels (int): Number of channels
+        full_scale (float): Largest possible sample magnitude
+        min_silence_len (int): Minimum length of silence in milliseconds
+        silence_thresh (int): Silence threshold in dBFS
+    
+    Returns:
+        list: [start_ms, end_ms] pairs of audio to keep
+    
+    The RMS of every min_silence_len window comes from differences of one
+    cumulative sum; windows at or below the threshold are merged wherever
+    they overlap or touch, as pydub does. Windows running past the end of
+    the data are averaged over the frames they actually hold.
+    """
+    seg_len = len(energy)
+    if seg_len < min_silence_len:
+        return [[0, seg_len]]
+    threshold = 10 ** (silence_thresh / 20) * full_scale
+    
+    cumulative = np.concatenate(([0.0], np.cumsum(energy)))
+    starts = np.arange(seg_len - min_silence_len + 1)
+    window_energy = cumulative[starts + min_silence_len] - cumulative[starts]
+    clipped = np.minimum(bounds, frame_count)
+    window_samples = (clipped[starts + min_silence_len] - clipped[starts]) * channels
+    rms = np.sqrt(np.maximum(window_energy, 0) / np.maximum(window_samples, 1))
+    if full_scale > 1:
+        rms = np.floor(rms)  # audioop.rms truncates integer samples' RMS
+    silent_starts = starts[rms <= threshold]
+    if not len(silent_starts):
+        return [[0, seg_len]]
+    
+    # A new silent range begins wherever a window starts after the previous one ended
+    breaks = np.flatnonzero(np.diff(silent_starts) > min_silence_len)
+    range_starts = silent_starts[np.concatenate(([0], breaks + 1))]
+    range_ends = silent_starts[np.concatenate((breaks, [len(silent_starts) - 1]))] + min_silence_len
+    
+    # Keep what lies between the silent ranges
+    keep_starts = np.concatenate(([0], range_ends))
+    keep_ends = np.concatenate((range_starts, [seg_len]))
+    keep = keep_ends > keep_starts
+    return [[int(start), int(end)] for start, end in zip(keep_starts[keep], keep_ends[keep])]
+
+def write_segments(writer, wav, frame_ranges, crossfade_frames=0):
+    """
+    Copy frame ranges of the input to a WAV writer, optionally crossfading at each splice.
+    
+    Args:
+        writer (WavWriter): Open output file
+        wav (WavFile): Memory-mapped input
+        frame_ranges (list): (start, end) frame pairs to keep, in order
+        crossfade_frames (int): Overlap at each splice (0 for a plain cut)
+    
+    Returns:
+        int: Frames written
+    
+    Frames are copied straight from the mapped input in bounded blocks.
+    With a crossfade the last crossfade_frames of each range are held back
+    (as a view, not a copy) and mixed, with equal-power gains, into the
+    start of the next range, so each splice shortens the output by that much.
+    """
+    frames = wav.raw
+    written = 0
+    
+    def copy(block):
+        nonlocal written
+        for i in range(0, len(block), WRITE_BLOCK_FRAMES):
+            writer.writeframesraw(block[i:i + WRITE_BLOCK_FRAMES])
+        written += len(block)
+    
+    held = frames[:0]
+    for start, end in frame_ranges:
+        fade = min(crossfade_frames, len(held), end - start)
+        if fade:
+            copy(held[:len(held) - fade])
+            t = (np.arange(fade) + 0.5) / fade * (np.pi / 2)
+            mixed = (pcm_to_float(held[len(held) - fade:], wav.sample_width, wav.is_float) * np.cos(t)[:, None]
+                     + wav.read(start, start + fade) * np.sin(t)[:, None])
+            copy(float_to_pcm(mixed, wav.sample_width, wav.is_float))
+            start += fade
+        else:
+            copy(held)
+        hold = min(crossfade_frames, end - start)
+        copy(frames[start:end - hold])
+        held = frames[end - hold:end]
+    copy(held)
+    return written
+
+def remove_silence_from_audio(input_file, output_file, min_silence_len=2000, silence_thresh=-50, crossfade_ms=0):
     """
     Remove silence from audio file that's longer than min_silence_len milliseconds.
     
@@ -13,36 +147,35 @@ def remove_silence_from_audio(input_file, output_file, min_silence_len=2000, sil
         output_file (str): Path to output WAV file
         min_silence_len (int): Minimum length of silence to remove in milliseconds
         silence_thresh (int): Silence threshold in dBFS (default -50dBFS)
+        crossfade_ms (float): Crossfade at each splice in milliseconds (default 0, a plain cut)
+    
+    The input is memory-mapped and the kept audio is copied from it straight
+    into the output WAV, so memory use does not grow with the file size.
     """
     try:
-        # Load audio file
-        audio = AudioSegment.from_wav(input_file)
+        # Map the audio data without reading it
+        wav = WavFile(input_file)
+        duration_ms = round(1000 * wav.duration)
+        bounds = ms_boundaries(wav.frame_rate, duration_ms)
         
         # Detect non-silent chunks
-        nonsilent_chunks = detect_nonsilent(
-            audio,
-            min_silence_len=min_silence_len,
-            silence_thresh=silence_thresh
-        )
+        energy = ms_energy(wav, bounds)
+        nonsilent_chunks = detect_nonsilent_ranges(energy, bounds, len(wav), wav.channels, wav.full_scale,
+                                                   min_silence_len, silence_thresh)
         
         if not nonsilent_chunks:
             print(f"Warning: No non-silent audio detected in {input_file}")
             return False
         
-        # Combine non-silent chunks
-        output_audio = AudioSegment.empty()
-        for start_i, end_i in nonsilent_chunks:
-            output_audio += audio[start_i:end_i]
+        # Write the non-silent chunks with the same parameters as the input
+        frame_ranges = [(min(bounds[start_i], len(wav)), min(bounds[end_i], len(wav)))
+                        for start_i, end_i in nonsilent_chunks]
+        with WavWriter(output_file, wav.channels, wav.sample_width, wav.frame_rate, wav.is_float,
+                       wav.channel_mask) as writer:
+            written = write_segments(writer, wav, frame_ranges, int(round(crossfade_ms * wav.frame_rate / 1000)))
         
-        # Export with same parameters as input
-        output_audio.export(
-            output_file,
-            format="wav",
-            parameters=["-ar", str(audio.frame_rate), "-ac", str(audio.channels)]
-        )
-        
-        original_duration = len(audio) / 1000  # Convert to seconds
-        new_duration = len(output_audio) / 1000
+        original_duration = wav.duration
+        new_duration = written / wav.frame_rate
         removed_duration = original_duration - new_duration
         
         print(f"Processed {input_file}:")
@@ -56,7 +189,7 @@ def remove_silence_from_audio(input_file, output_file, min_silence_len=2000, sil
         print(f"Error processing {input_file}: {str(e)}")
         return False
 
-def process_directory(input_dir, output_dir, min_silence_seconds=2, silence_thresh=-50):
+def process_directory(input_dir, output_dir, min_silence_seconds=2, silence_thresh=-50, crossfade_ms=0):
     """
     Process all WAV files in input directory and save to output directory.
     
@@ -65,6 +198,7 @@ def process_directory(input_dir, output_dir, min_silence_seconds=2, silence_thre
         output_dir (str): Output directory path
         min_silence_seconds (float): Minimum silence duration to remove in seconds
         silence_thresh (int): Silence threshold in dBFS
+        crossfade_ms (float): Crossfade at each splice in milliseconds
     """
     input_path = Path(input_dir)
     output_path = Path(output_dir)
@@ -85,6 +219,8 @@ def process_directory(input_dir, output_dir, min_silence_seconds=2, silence_thre
     print(f"Found {len(wav_files)} WAV files to process")
     print(f"Silence threshold: {silence_thresh} dBFS")
     print(f"Minimum silence duration: {min_silence_seconds}s")
+    if crossfade_ms:
+        print(f"Crossfade: {crossfade_ms}ms")
     print("-" * 50)
     
     processed_count = 0
@@ -98,7 +234,8 @@ def process_directory(input_dir, output_dir, min_silence_seconds=2, silence_thre
             str(wav_file), 
             str(output_file), 
             min_silence_len, 
-            silence_thresh
+            silence_thresh,
+            crossfade_ms
         ):
             processed_count += 1
         
@@ -130,6 +267,12 @@ def main():
         default=-50,
         help="Silence threshold in dBFS (default: -50)"
     )
+    parser.add_argument(
+        "-c", "--crossfade", 
+        type=float, 
+        default=0,
+        help="Crossfade at each splice in milliseconds (default: 0, a plain cut)"
+    )
     
     args = parser.parse_args()
     
@@ -142,7 +285,8 @@ def main():
         args.input_dir, 
         args.output_dir, 
         args.silence_duration, 
-        args.threshold
+        args.threshold,
+        args.crossfade
     )
 
 if __name__ == "__main__":
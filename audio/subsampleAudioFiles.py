@@ -1,7 +1,15 @@
 import argparse
 import os
+import subprocess
 from datetime import datetime
 from pydub import AudioSegment
+from wav_mmap import WavFile
+
+SNIPPET_START = 0.01  # fraction of the file's duration where the snippet starts
+SNIPPET_SECONDS = 180  # maximum snippet duration
+OUTPUT_RATE = 22050
+OUTPUT_BITRATE = '32k'
+HEADROOM_DB = 0.1  # pydub's normalize() default
 
 def sanitize_filename(filename):
     """Sanitizes filenames to remove spaces and problematic characters."""
@@ -15,6 +23,43 @@ def normalize_audio(audio):
     """Normalizes the audio to a consistent perceived loudness."""
     return audio.normalize()
 
+def snippet_frames(wav):
+    """First and last frame of the snippet, on the millisecond grid pydub slices on."""
+    start_ms = int(round(1000 * wav.duration) * SNIPPET_START)
+    start = int(start_ms * (wav.frame_rate / 1000.0))
+    end = int((start_ms + SNIPPET_SECONDS * 1000) * (wav.frame_rate / 1000.0))
+    return start, min(end, len(wav))
+
+def extract_wav_snippet(file_path, output_file_path):
+    """Snippet, normalise, downmix and encode a WAV without loading it.
+
+    The file is memory-mapped and only the snippet is read, block by block:
+    once to find its peak, then again (from the page cache) to stream
+    normalised mono float samples to ffmpeg, which resamples and encodes.
+    """
+    with WavFile(file_path) as wav:
+        start, end = snippet_frames(wav)
+        peak = 0.0
+        for _, block in wav.blocks(start, end):
+            peak = max(peak, float(abs(block).max(initial=0)))
+        # Peak-normalise to HEADROOM_DB below full scale, as AudioSegment.normalize() does
+        gain = 10 ** (-HEADROOM_DB / 20) * wav.full_scale / peak if peak else 1.0
+
+        command = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'f32le', '-ar', str(wav.frame_rate), '-ac', '1',
+                   '-i', '-', '-ar', str(OUTPUT_RATE), '-b:a', OUTPUT_BITRATE, '-f', 'mp3', output_file_path]
+        process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        try:
+            for _, block in wav.blocks(start, end):
+                mono = block.mean(axis=1) * (gain / wav.full_scale)
+                process.stdin.write(mono.astype('<f4').tobytes())
+        except BrokenPipeError:
+            pass
+        finally:
+            process.stdin.close()
+            returncode = process.wait()
+    if returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with code {returncode}")
+
 def extract_audio_snippet(input_dir, output_dir):
     """Extracts a 2-minute snippet from each audio file starting from 33% of its duration."""
     # Create the output directory if it does not exist
@@ -24,10 +69,22 @@ def extract_audio_snippet(input_dir, output_dir):
     for file_name in os.listdir(input_dir):
         if file_name.lower().endswith(('.mp3', '.wav')):
             file_path = os.path.join(input_dir, file_name)
+            sanitized_file_name = sanitize_filename(f"snippet_{file_name}")
+            output_file_path = os.path.join(output_dir, sanitized_file_name)
+
+            # WAVs are streamed from a memory map; anything else is decoded whole by pydub
+            if file_name.lower().endswith('.wav'):
+                try:
+                    extract_wav_snippet(file_path, output_file_path)
+                    print(f"Processed {file_name} and saved to {output_file_path}")
+                    continue
+                except ValueError as e:
+                    print(f"{file_name}: {e}; falling back to pydub")
+
             audio = AudioSegment.from_file(file_path)
 
-            start_time = int(len(audio) * 0.01) # percentage of sample time to start truncated clip at
-            max_duration = 180 * 1000 # new sample duration in seconds (maximum)
+            start_time = int(len(audio) * SNIPPET_START) # percentage of sample time to start truncated clip at
+            max_duration = SNIPPET_SECONDS * 1000 # new sample duration in seconds (maximum)
             end_time = start_time + max_duration
 
             # Clip the audio to not exceed the file's length
@@ -38,11 +95,9 @@ def extract_audio_snippet(input_dir, output_dir):
 
             # Convert to mono and set to 64 kbps for file size optimization
             snippet = snippet.set_channels(1)
-            snippet = snippet.set_frame_rate(22050)  # Lower sample rate to further reduce file size
+            snippet = snippet.set_frame_rate(OUTPUT_RATE)  # Lower sample rate to further reduce file size
 
-            sanitized_file_name = sanitize_filename(f"snippet_{file_name}")
-            output_file_path = os.path.join(output_dir, sanitized_file_name)
-            snippet.export(output_file_path, format='mp3', bitrate='32k')
+            snippet.export(output_file_path, format='mp3', bitrate=OUTPUT_BITRATE)
 
             print(f"Processed {file_name} and saved to {output_file_path}")
 
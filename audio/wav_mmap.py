@@ -0,0 +1,219 @@
+"""Memory-mapped access to PCM WAV, RF64 and BW64 files.
+
+WavFile parses the headers and maps the data chunk; nothing else is read
+until a block is used, so multi-GB recordings cost no more memory than the
+blocks being worked on. Integer PCM (8, 16, 24 and 32-bit) and IEEE float
+(32 and 64-bit) are handled, in plain or WAVE_FORMAT_EXTENSIBLE headers.
+Blocks come back as NumPy arrays of shape (frames, channels): views of the
+file where NumPy has a matching dtype, and 24-bit widened to int32.
+
+WavWriter streams frames to a new file and fills in the sizes on close,
+switching the header to RF64 when the data outgrows 4 GiB.
+"""
+import os
+import struct
+
+import numpy as np
+
+PCM = 1
+IEEE_FLOAT = 3
+EXTENSIBLE = 0xFFFE
+
+# Tail of the KSDATAFORMAT_SUBTYPE GUIDs; the first two bytes are the format tag
+SUBTYPE_SUFFIX = b"\x00\x00\x00\x00\x10\x00\x80\x00\x00\xaa\x00\x38\x9b\x71"
+
+BLOCK_FRAMES = 1 << 18
+
+_NATIVE_DTYPES = {(False, 1): "u1", (False, 2): "<i2", (False, 4): "<i4", (True, 4): "<f4", (True, 8): "<f8"}
+
+
+def pcm_to_float(raw, sample_width, is_float=False):
+    """Decode raw frames to float64 samples, shape (frames, channels).
+
+    Integer formats keep their integer scale (8-bit is re-centred on 0), so
+    a full-scale value is 2**(bits - 1); float formats are returned as is.
+    """
+    data = np.ascontiguousarray(raw)
+    if is_float or sample_width in (2, 4):
+        samples = data.view(_NATIVE_DTYPES[is_float, sample_width]).astype(np.float64)
+    elif sample_width == 1:
+        samples = data.astype(np.float64) - 128
+    elif sample_width == 3:
+        triples = data.reshape(len(data), -1, 3).astype(np.int32)
+        values = triples[..., 0] | (triples[..., 1] << 8) | (triples[..., 2] << 16)
+        samples = ((values ^ 0x800000) - 0x800000).astype(np.float64)
+    else:
+        raise ValueError(f"unsupported sample width {sample_width}")
+    return samples.reshape(len(data), -1)
+
+
+def float_to_pcm(samples, sample_width, is_float=False):
+    """Encode float samples (on the pcm_to_float scale) back to raw frames, rounding and clipping integers."""
+    if is_float:
+        values = samples.astype(_NATIVE_DTYPES[True, sample_width])
+        return values.view(np.uint8).reshape(len(samples), -1)
+    limit = 1 << (8 * sample_width - 1)
+    values = np.clip(np.rint(samples), -limit, limit - 1).astype(np.int64)
+    if sample_width == 1:
+        return (values + 128).astype(np.uint8)
+    if sample_width == 3:
+        return values.astype("<i4").view(np.uint8).reshape(len(values), -1, 4)[..., :3].reshape(len(values), -1)
+    return values.astype(_NATIVE_DTYPES[False, sample_width]).view(np.uint8).reshape(len(values), -1)
+
+
+class WavFile:
+    """The sample data of a WAV/RF64 file, memory-mapped.
+
+    Attributes: channels, sample_width (bytes), frame_rate, is_float,
+    channel_mask, full_scale (largest sample magnitude) and raw, a
+    read-only (frames, bytes per frame) uint8 map of the data chunk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            riff, riff_size, wave_id = struct.unpack("<4sI4s", f.read(12))
+            if riff not in (b"RIFF", b"RF64", b"BW64") or wave_id != b"WAVE":
+                raise ValueError(f"{path} is not a WAV file")
+            fmt = None
+            data_size64 = None
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    raise ValueError(f"{path} has no data chunk")
+                chunk_id, size = struct.unpack("<4sI", header)
+                if chunk_id == b"ds64":
+                    data_size64 = struct.unpack("<QQ", f.read(16))[1]
+                    size -= 16
+                elif chunk_id == b"fmt ":
+                    fmt = f.read(size)
+                    size = 0
+                elif chunk_id == b"data":
+                    offset = f.tell()
+                    break
+                f.seek(size + (size % 2), os.SEEK_CUR)
+            file_size = f.seek(0, os.SEEK_END)
+        if fmt is None:
+            raise ValueError(f"{path} has no fmt chunk")
+        if size == 0xFFFFFFFF and data_size64 is not None:
+            size = data_size64
+
+        format_tag, self.channels, self.frame_rate, _, block_align, bits = struct.unpack("<HHIIHH", fmt[:16])
+        self.channel_mask = 0
+        if format_tag == EXTENSIBLE and len(fmt) >= 40:
+            self.channel_mask = struct.unpack("<I", fmt[20:24])[0]
+            format_tag = struct.unpack("<H", fmt[24:26])[0]
+        if format_tag not in (PCM, IEEE_FLOAT):
+            raise ValueError(f"{path}: unsupported WAV format tag {format_tag:#x}")
+        self.is_float = format_tag == IEEE_FLOAT
+        self.sample_width = block_align // self.channels
+        int24 = self.sample_width == 3 and not self.is_float
+        if (self.is_float, self.sample_width) not in _NATIVE_DTYPES and not int24:
+            raise ValueError(f"{path}: unsupported {bits}-bit {'float' if self.is_float else 'PCM'} data")
+        self.full_scale = 1.0 if self.is_float else float(1 << (8 * self.sample_width - 1))
+
+        # A data size running past the end of the file (an interrupted recording) is cut to what is there
+        frame_count = min(size, file_size - offset) // block_align
+        self.raw = np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=(frame_count, block_align))
+
+    def __len__(self):
+        return len(self.raw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # The map itself is released once no block views of it remain
+        self.raw = np.empty((0, self.raw.shape[1]), dtype=np.uint8)
+
+    @property
+    def duration(self):
+        return len(self) / self.frame_rate
+
+    def block(self, start=0, end=None):
+        """Frames start..end as a (frames, channels) array.
+
+        A view of the file for 8-bit (uint8, offset by 128), 16/32-bit int
+        and float data; 24-bit frames are widened into a new int32 array.
+        """
+        raw = self.raw[start:end]
+        if self.sample_width == 3 and not self.is_float:
+            return pcm_to_float(raw, 3).astype(np.int32)
+        return raw.view(_NATIVE_DTYPES[self.is_float, self.sample_width])
+
+    def read(self, start=0, end=None):
+        """Frames start..end decoded to float64 on the integer scale (see pcm_to_float)."""
+        return pcm_to_float(self.raw[start:end], self.sample_width, self.is_float)
+
+    def blocks(self, start=0, end=None, block_frames=BLOCK_FRAMES, decode=True):
+        """Yield (first frame, samples) for consecutive blocks of start..end.
+
+        Samples are as from read(), or from block() with decode=False.
+        """
+        end = len(self) if end is None else min(end, len(self))
+        for first in range(start, end, block_frames):
+            last = min(first + block_frames, end)
+            yield first, self.read(first, last) if decode else self.block(first, last)
+
+
+class WavWriter:
+    """Stream frames into a new WAV file.
+
+    The header is written up front with room reserved (as a JUNK chunk) for
+    an RF64 ds64 chunk, and completed on close: a plain RIFF header while the
+    data fits in 4 GiB, RF64 beyond that. More than two channels, more than
+    16 bits or float data get a WAVE_FORMAT_EXTENSIBLE format chunk.
+    """
+
+    def __init__(self, path, channels, sample_width, frame_rate, is_float=False, channel_mask=0):
+        self.block_align = channels * sample_width
+        self.data_size = 0
+        self.file = open(path, "wb")
+        tag = IEEE_FLOAT if is_float else PCM
+        fields = (channels, frame_rate, frame_rate * self.block_align, self.block_align, 8 * sample_width)
+        if channels > 2 or sample_width > 2 or is_float:
+            fmt = struct.pack("<HHIIHHHHI", EXTENSIBLE, *fields, 22, 8 * sample_width, channel_mask)
+            fmt += struct.pack("<H", tag) + SUBTYPE_SUFFIX
+        else:
+            fmt = struct.pack("<HHIIHH", tag, *fields)
+        self.file.write(b"RIFF\0\0\0\0WAVE")
+        self.file.write(b"JUNK" + struct.pack("<I", 28) + bytes(28))
+        self.file.write(b"fmt " + struct.pack("<I", len(fmt)) + fmt)
+        self.file.write(b"data\0\0\0\0")
+        self.data_offset = self.file.tell()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def writeframesraw(self, data):
+        """Append raw frames (bytes or a uint8 (frames, bytes per frame) array)."""
+        view = memoryview(np.ascontiguousarray(data)).cast("B") if isinstance(data, np.ndarray) else memoryview(data)
+        self.file.write(view)
+        self.data_size += view.nbytes
+
+    def close(self):
+        if self.file.closed:
+            return
+        if self.data_size % 2:
+            self.file.write(b"\0")
+        riff_size = self.file.tell() - 8
+        if riff_size > 0xFFFFFFFF:
+            self.file.seek(0)
+            self.file.write(b"RF64" + struct.pack("<I", 0xFFFFFFFF))
+            frames = self.data_size // self.block_align
+            self.file.seek(12)
+            self.file.write(b"ds64" + struct.pack("<IQQQI", 28, riff_size, self.data_size, frames, 0))
+            self.file.seek(self.data_offset - 4)
+            self.file.write(struct.pack("<I", 0xFFFFFFFF))
+        else:
+            self.file.seek(4)
+            self.file.write(struct.pack("<I", riff_size))
+            self.file.seek(self.data_offset - 4)
+            self.file.write(struct.pack("<I", self.data_size))
+        self.file.close()
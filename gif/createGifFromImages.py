@@ -1,10 +1,15 @@
 import os
 import argparse
 import imageio.v2 as imageio
-from PIL import Image, ImageSequence
+from PIL import Image
 from tqdm import tqdm
 import subprocess
-import shutil
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from gif_palette import PaletteMapper, build_palette, palette_bytes, sample_indices
+from gif_writer import DeltaGifWriter, GifWriter
 
 def process_image(img_path):
     img = Image.open(img_path).convert("RGBA")  # Ensure transparency is preserved
@@ -22,6 +27,50 @@ def process_image(img_path):
 
     return img
 
+def imap_bounded(func, items, workers=1, max_in_flight=None, initializer=None, initargs=()):
+    """Yield func(item) for each item, in order, computed on a process pool.
+
+    At most max_in_flight results are pending or waiting to be consumed at
+    any time, so memory stays flat however long the input is. With a single
+    worker everything runs in this process.
+    """
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for item in items:
+            yield func(item)
+        return
+
+    max_in_flight = max_in_flight or 4 * workers
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        pending = deque()
+        for item in items:
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+            pending.append(executor.submit(func, item))
+        while pending:
+            yield pending.popleft().result()
+
+def process_image_safe(img_path):
+    """Return (img_path, processed image or None, error message or None)."""
+    try:
+        return img_path, process_image(img_path), None
+    except Exception as e:
+        return img_path, None, str(e)
+
+_palette_mapper = None
+
+def init_palette_worker(mapper):
+    global _palette_mapper
+    _palette_mapper = mapper
+
+def map_image_safe(img_path):
+    """Decode one frame and map it to the shared palette; errors are returned, not raised."""
+    try:
+        return img_path, _palette_mapper.map(load_rgba(img_path)), None
+    except Exception as e:
+        return img_path, None, str(e)
+
 def create_gif(image_files, gif_path):
     images = [process_image(x) for x in tqdm(image_files, desc="Processing images")]
     images[0].save(
@@ -34,70 +83,80 @@ def create_gif(image_files, gif_path):
         disposal=2
     )
 
-def create_gif_batch(image_files, gif_path, batch_size=500, lossy=None):
-    num_batches = len(image_files) // batch_size
-    temp_gifs = []
-
-    for i in tqdm(range(num_batches + 1), desc="Processing batches"):
-        batch_images = image_files[i * batch_size: (i + 1) * batch_size]
-        if not batch_images:
-            continue
-
-        images = []
-        for img_path in tqdm(batch_images, desc="Reading images", leave=False):
-            try:
-                img = process_image(img_path)
-                images.append(img)
-            except Exception as e:
-                print(f"Skipping image {img_path} due to error: {e}")
-
-        temp_gif_path = f"temp_{i}.gif"
-
-        if images:
-            images[0].save(
-                temp_gif_path,
-                save_all=True,
-                append_images=images[1:],
-                optimize=True,
-                duration=1000/12,
-                loop=0,
-                disposal=2
-            )
-            temp_gifs.append(temp_gif_path)
-
-    # Handle final output based on batch count
-    if len(temp_gifs) == 1:
-        # Only one batch, simply rename
-        shutil.move(temp_gifs[0], gif_path)
-        print(f"Single batch detected, renamed {temp_gifs[0]} to {gif_path}")
-    else:
-        # Multiple batches, concatenate GIFs
-        final_gif_frames = []
-        for temp_gif in tqdm(temp_gifs, desc="Concatenating GIFs"):
-            with Image.open(temp_gif) as img:
-                for frame in ImageSequence.Iterator(img):
-                    final_frame = frame.copy()
-                    final_gif_frames.append(final_frame)
-
-        if final_gif_frames:
-            final_gif_frames[0].save(
-                gif_path,
-                save_all=True,
-                append_images=final_gif_frames[1:],
-                duration=80,
-                loop=0,
-                disposal=2
-            )
-
-        print(f"Multiple batches processed, concatenated into {gif_path}")
-
-    # Cleanup temporary GIFs
-    for temp_gif in temp_gifs:
-        if os.path.exists(temp_gif):
-            os.remove(temp_gif)
+def create_gif_batch(image_files, gif_path, batch_size=500, lossy=None, duration=1000/12, workers=1,
+                     max_in_flight=None, ping_pong=False):
+    """Quantize and encode frames into one append-only GIF.
+
+    Frames are decoded and quantized on one pool of `workers` processes and
+    appended to the output in order as soon as they are ready, so no
+    intermediate GIFs are written or decoded again. At most max_in_flight
+    frames (and never more than batch_size) are held in memory. With
+    ping_pong the encoded frames are replayed in reverse (excluding the
+    first and last).
+    """
+    max_in_flight = min(batch_size, max_in_flight or 4 * workers)
+
+    with GifWriter(gif_path) as writer:
+        results = imap_bounded(process_image_safe, image_files, workers, max_in_flight)
+        for img_path, img, error in tqdm(results, total=len(image_files), desc="Encoding images"):
+            if error is not None:
+                print(f"Skipping image {img_path} due to error: {error}")
+                continue
+            writer.append(img, duration)
+        if ping_pong:
+            writer.repeat_frames(range(writer.frame_count - 2, 0, -1))
+
+    print(f"Wrote {writer.frame_count} frames to {gif_path}")
+
+    # Apply optional lossy compression
+    if lossy is not None and writer.frame_count:
+        apply_lossy_compression(gif_path, lossy)
+
+def load_rgba(img_path):
+    with Image.open(img_path) as img:
+        return np.asarray(img.convert("RGBA"))
+
+def create_gif_shared_palette(image_files, gif_path, duration=1000/12, palette_samples=16, lossy=None, workers=1,
+                              max_in_flight=None):
+    """Encode a GIF against one global palette in a single streaming pass.
+
+    The palette is median-cut from `palette_samples` evenly spaced frames.
+    Every frame is then mapped to it with a lookup table and only the
+    rectangle that changed since the previous frame is written, straight to
+    the output file with no temp GIFs. Decoding and palette mapping run on
+    `workers` processes while this process encodes in order.
+    """
+    sample = []
+    for i in sample_indices(len(image_files), palette_samples):
+        try:
+            sample.append(load_rgba(image_files[i]))
+        except Exception as e:
+            print(f"Skipping palette sample {image_files[i]} due to error: {e}")
+    palette = build_palette(sample)
+    mapper = PaletteMapper(palette)
+    del sample
+
+    results = imap_bounded(map_image_safe, image_files, workers, max_in_flight,
+                           initializer=init_palette_worker, initargs=(mapper,))
+    with DeltaGifWriter(gif_path, palette_bytes(palette)) as writer:
+        for img_path, indices, error in tqdm(results, total=len(image_files), desc="Encoding frames"):
+            if error is not None:
+                print(f"Skipping image {img_path} due to error: {error}")
+                continue
+            height, width = indices.shape
+            if writer.size and (width, height) != writer.size:
+                print(f"Skipping image {img_path}: size {width}x{height} does not match "
+                      f"{writer.size[0]}x{writer.size[1]}")
+                continue
+            writer.append_indices(indices, duration)
+
+    if writer.frame_count:
+        total = writer.size[0] * writer.size[1] * len(image_files)
+        print(f"Wrote {writer.frame_count} frames to {gif_path} "
+              f"({100 * writer.pixels_skipped / total:.0f}% of pixels skipped as unchanged)")
 
     # Apply optional lossy compression
-    if lossy is not None:
+    if lossy is not None and writer.frame_count:
         apply_lossy_compression(gif_path, lossy)
 
 def apply_lossy_compression(gif_path, lossy_level):
@@ -118,10 +177,25 @@ def main():
     parser = argparse.ArgumentParser(description="Create GIFs from a list of PNG images")
     parser.add_argument("input_folder", help="Path to the input folder containing PNG images")
     parser.add_argument("output_gif", help="Path to the output GIF file")
-    parser.add_argument("--batch-size", type=int, default=500, help="Batch size for processing images (default: 500)")
+    parser.add_argument("--batch-size", type=int, default=500, help="Frames held in memory at most, whatever --max-in-flight says (default: 500)")
     parser.add_argument("--lossy", type=int, help="Apply lossy compression with specified level (e.g., --lossy=500)")
+    parser.add_argument("--encoder", choices=["batch", "shared-palette"], default="batch",
+                        help="batch: per-frame adaptive palettes; shared-palette: one global palette with "
+                             "delta frames in a single pass (default: batch)")
+    parser.add_argument("--palette-samples", type=int, default=16,
+                        help="Frames sampled to build the shared palette (default: 16)")
+    parser.add_argument("--duration", type=float, default=1000/12,
+                        help="Frame duration in milliseconds (default: 83.3, i.e. 12 fps)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes that decode and quantize frames; 0 uses every core (default: 1)")
+    parser.add_argument("--max-in-flight", type=int,
+                        help="Frames decoded ahead of the encoder at most (default: 4 per worker)")
+    parser.add_argument("--ping-pong", action="store_true",
+                        help="Play the frames forwards then backwards (batch encoder only)")
 
     args = parser.parse_args()
+    if args.ping_pong and args.encoder == "shared-palette":
+        parser.error("--ping-pong is not supported with --encoder shared-palette (delta frames cannot be replayed)")
 
     input_folder = args.input_folder
     output_gif = args.output_gif
@@ -134,7 +208,15 @@ def main():
 
     image_files = sorted([os.path.join(input_folder, img) for img in os.listdir(input_folder) if img.endswith(".png")])
 
-    create_gif_batch(image_files, output_gif, batch_size=batch_size, lossy=lossy)
+    workers = args.workers if args.workers > 0 else os.cpu_count()
+
+    if args.encoder == "shared-palette":
+        create_gif_shared_palette(image_files, output_gif, duration=args.duration,
+                                  palette_samples=args.palette_samples, lossy=lossy,
+                                  workers=workers, max_in_flight=args.max_in_flight)
+    else:
+        create_gif_batch(image_files, output_gif, batch_size=batch_size, lossy=lossy, duration=args.duration,
+                         workers=workers, max_in_flight=args.max_in_flight, ping_pong=args.ping_pong)
 
 if __name__ == "__main__":
     main()
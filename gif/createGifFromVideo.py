@@ -5,6 +5,8 @@ import numpy as np
 from tqdm import tqdm
 import argparse
 
+from gif_writer import GifWriter
+
 def is_frame_corrupt(frame_path):
     try:
         with Image.open(frame_path) as img:
@@ -18,41 +20,157 @@ def count_dark_pixels(image, threshold=50):
     np_image = np.array(grayscale)
     return np.sum(np_image < threshold)
 
-def remove_outlier_frames(frame_paths, resize, z_threshold=2):
-    frames = [Image.open(f).convert('RGBA').resize(resize, Image.NEAREST) for f in frame_paths]
-    dark_counts = [count_dark_pixels(frame) for frame in frames]
+def outlier_mask(dark_counts, z_threshold=2):
+    """True for frames whose dark pixel count is within z_threshold std devs of the median."""
+    counts = np.asarray(dark_counts, dtype=np.float64)
+    if counts.size == 0:
+        return np.zeros(0, dtype=bool)
+    return np.abs(counts - np.median(counts)) <= z_threshold * np.std(counts)
+
+def analysis_size(resize, downsample=1):
+    """Size used for dark pixel statistics; downsampling keeps the z-scores comparable."""
+    return (max(1, resize[0] // downsample), max(1, resize[1] // downsample))
+
+def dark_pixel_counts(frame_paths, resize, dark_threshold=50, downsample=1):
+    """First pass: one dark pixel count per frame, from a grayscale decode.
+
+    Only the integer counts are kept, so memory does not depend on the number
+    of frames. With downsample > 1 the counts are taken at a reduced size.
+    """
+    size = analysis_size(resize, downsample)
+    counts = np.zeros(len(frame_paths), dtype=np.int64)
+    for i, frame_path in enumerate(tqdm(frame_paths, desc="Scanning frames")):
+        with Image.open(frame_path) as img:
+            img.draft('L', size)
+            grayscale = img.convert('L').resize(size, Image.NEAREST)
+        counts[i] = count_dark_pixels(grayscale, dark_threshold)
+    return counts
+
+def remove_outlier_frames(frame_paths, resize, z_threshold=2, dark_threshold=50, downsample=1):
+    """Return the frame paths whose dark pixel count passes the z-score test.
+
+    Frames are not kept in memory; decode the returned paths with load_frame
+    in a second pass.
+    """
+    dark_counts = dark_pixel_counts(frame_paths, resize, dark_threshold, downsample)
+    keep = outlier_mask(dark_counts, z_threshold)
+    return [frame_path for frame_path, valid in zip(frame_paths, keep) if valid]
+
+def load_frame(frame_path, resize):
+    with Image.open(frame_path) as img:
+        return img.convert('RGBA').resize(resize, Image.NEAREST)
+
+def write_gif(frames, output_gif, frame_rate, ping_pong=True):
+    """Stream frames into a GIF, optionally followed by the reversed sequence.
+
+    Ping-pong playback replays the already encoded frames by index (excluding
+    the first and last) instead of keeping or duplicating frame objects.
+    Returns the number of frames written; if no frames arrive (an empty or
+    unreadable input) nothing is written and 0 is returned.
+    """
+    with GifWriter(output_gif) as writer:
+        for frame in frames:
+            writer.append(frame, 1000 // frame_rate)
+        if ping_pong:
+            writer.repeat_frames(range(writer.frame_count - 2, 0, -1))
+    if writer.frame_count == 0:
+        print(f"No frames decoded; {output_gif} was not written.")
+    return writer.frame_count
+
+def ffmpeg_frames(input_video, size, frame_rate, pix_fmt="rgba", scale_flags="neighbor"):
+    """Yield frames decoded and scaled by ffmpeg, read from a rawvideo pipe.
+
+    Every frame is read into the same preallocated buffer and yielded as a
+    NumPy view over it, so nothing is copied or allocated per frame. A
+    yielded array is only valid until the next one is requested.
+    """
+    channels = {"rgba": 4, "rgb24": 3, "gray": 1}[pix_fmt]
+    width, height = size
+    command = [
+        'ffmpeg', '-v', 'error', '-nostdin',
+        '-i', input_video,
+        '-vf', f'fps={frame_rate},scale={width}:{height}:flags={scale_flags}',
+        '-f', 'rawvideo', '-pix_fmt', pix_fmt, '-'
+    ]
+
+    frame_bytes = width * height * channels
+    buffer = bytearray(frame_bytes)
+    view = memoryview(buffer)
+    shape = (height, width, channels) if channels > 1 else (height, width)
+    frame = np.frombuffer(buffer, dtype=np.uint8).reshape(shape)
+
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    finished = False
+    try:
+        while True:
+            filled = 0
+            while filled < frame_bytes:
+                count = process.stdout.readinto(view[filled:])
+                if not count:
+                    break
+                filled += count
+            if filled < frame_bytes:
+                break
+            yield frame
+        finished = True
+    finally:
+        if not finished:
+            process.kill()
+        process.stdout.close()
+        errors = process.stderr.read().decode(errors="replace")
+        process.stderr.close()
+        process.wait()
+        if finished and process.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed on {input_video}: {errors.strip()}")
+
+def convert_video_to_gif_stream(input_video, output_gif, resize=(1024, 768), frame_rate=12, z_threshold=2,
+                                dark_threshold=50, downsample=1, ping_pong=True):
+    """Convert a video to a GIF by streaming raw frames out of ffmpeg.
+
+    ffmpeg does the frame rate conversion and scaling. A first grayscale pass
+    counts dark pixels (one integer per frame) for outlier filtering, and a
+    second RGBA pass encodes the surviving frames straight into the GIF. No
+    frames touch the disk as PNGs and only one frame is in memory at a time.
+    """
+    if not os.path.isfile(input_video):
+        print(f"Input video file '{input_video}' does not exist.")
+        return
 
-    median_dark = np.median(dark_counts)
-    std_dark = np.std(dark_counts)
+    scan = ffmpeg_frames(input_video, analysis_size(resize, downsample), frame_rate, "gray")
+    dark_counts = [np.count_nonzero(frame < dark_threshold) for frame in tqdm(scan, desc="Scanning frames")]
+    keep = outlier_mask(dark_counts, z_threshold)
 
-    valid_frames = [frame for frame, count in zip(frames, dark_counts) if abs(count - median_dark) <= z_threshold * std_dark]
-    return valid_frames
+    if not keep.any():
+        print("No valid frames were found after filtering.")
+        return
 
+    def kept_frames():
+        frames = ffmpeg_frames(input_video, resize, frame_rate, "rgba")
+        for index, frame in enumerate(tqdm(frames, total=len(keep), desc="Encoding frames")):
+            if index < len(keep) and keep[index]:
+                yield Image.frombuffer('RGBA', resize, frame, 'raw', 'RGBA', 0, 1)
 
+    if write_gif(kept_frames(), output_gif, frame_rate, ping_pong):
+        print("Conversion done.")
 
-def convert_video_to_gif(input_video, output_gif, resize=(1024, 768), frame_rate=12):
-    # Create a temporary directory for frames
-    temp_dir = "temp_frames"
-    os.makedirs(temp_dir, exist_ok=True)
-
+def convert_video_to_gif(input_video, output_gif, resize=(1024, 768), frame_rate=12, z_threshold=2,
+                         dark_threshold=50, downsample=1, ping_pong=True):
     # Check if the input video file exists
     if not os.path.isfile(input_video):
         print(f"Input video file '{input_video}' does not exist.")
         return
 
-    # Determine the input video file extension
+    # Only .mov and .mp4 inputs are supported
     _, input_extension = os.path.splitext(input_video)
     input_extension = input_extension.lower()
-
-    # Choose the appropriate FFmpeg codec based on the input file extension
-    if input_extension == ".mov":
-        codec = "png"
-    elif input_extension == ".mp4":
-        codec = "libx264"
-    else:
+    if input_extension not in (".mov", ".mp4"):
         print(f"Unsupported input video format: {input_extension}")
         return
 
+    # Create a temporary directory for frames
+    temp_dir = "temp_frames"
+    os.makedirs(temp_dir, exist_ok=True)
+
     # Convert the video to individual frames using FFmpeg
     subprocess.call([
         'ffmpeg',
@@ -65,27 +183,24 @@ def convert_video_to_gif(input_video, output_gif, resize=(1024, 768), frame_rate
     frame_files = sorted(os.path.join(temp_dir, f) for f in os.listdir(temp_dir))
     non_corrupt_frames = [f for f in frame_files if not is_frame_corrupt(f)]
 
-    # Remove outlier frames based on dark pixel count
-    frames = remove_outlier_frames(non_corrupt_frames, resize)
+    # Remove outlier frames based on dark pixel count (first pass)
+    valid_frames = remove_outlier_frames(non_corrupt_frames, resize, z_threshold, dark_threshold, downsample)
 
-    if not frames:
+    written = 0
+    if not valid_frames:
         print("No valid frames were found after filtering.")
-        return
-
-    # ping pong playback - comment out if not desired
-    frames = [frame for frame in frames]  # Copy frames into a list
-    reversed_frames = frames[::-1][1:-1]  # Reverse the frames, excluding the first and last
-    frames += reversed_frames             # Append the reversed frames to the original sequence
-
-    # Save as a GIF
-    frames[0].save(output_gif, save_all=True, append_images=frames[1:], optimize=True, duration=1000//frame_rate, loop=0, codec=codec)
+    else:
+        # Decode only the surviving frames and stream them into the GIF (second pass)
+        frames = (load_frame(f, resize) for f in tqdm(valid_frames, desc="Encoding frames"))
+        written = write_gif(frames, output_gif, frame_rate, ping_pong)
 
     # Cleanup temporary directory
     for frame_file in frame_files:
         os.remove(frame_file)
     os.rmdir(temp_dir)
 
-    print("Conversion done.")
+    if written:
+        print("Conversion done.")
 
 def main():
     parser = argparse.ArgumentParser(description="Convert video to GIF with optional resizing and frame rate")
@@ -95,6 +210,16 @@ def main():
                         help="Resize the output GIF (default: 1240 720)")
     parser.add_argument("--frame-rate", type=int, default=12, metavar="FRAME_RATE",
                         help="Frame rate of the output GIF (default: 12)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Pipe raw frames from ffmpeg instead of writing PNGs to temp_frames/")
+    parser.add_argument("--z-threshold", type=float, default=2,
+                        help="Drop frames whose dark pixel count is more than this many std devs from the median (default: 2)")
+    parser.add_argument("--dark-threshold", type=int, default=50,
+                        help="Grayscale level below which a pixel counts as dark (default: 50)")
+    parser.add_argument("--analysis-downsample", type=int, default=1,
+                        help="Compute dark pixel statistics at 1/N of the output size (default: 1)")
+    parser.add_argument("--no-ping-pong", action="store_true",
+                        help="Play the frames once instead of forwards then backwards")
 
     args = parser.parse_args()
 
@@ -103,7 +228,10 @@ def main():
     resize = tuple(args.resize)
     frame_rate = args.frame_rate
 
-    convert_video_to_gif(input_video, output_gif, resize=resize, frame_rate=frame_rate)
+    convert = convert_video_to_gif_stream if args.stream else convert_video_to_gif
+    convert(input_video, output_gif, resize=resize, frame_rate=frame_rate, z_threshold=args.z_threshold,
+            dark_threshold=args.dark_threshold, downsample=args.analysis_downsample,
+            ping_pong=not args.no_ping_pong)
 
 if __name__ == "__main__":
     main()
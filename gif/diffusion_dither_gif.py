@@ -1,7 +1,17 @@
 from PIL import Image, ImageSequence
 import numpy as np
 import os
+import sys
+import time
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from multiprocessing import shared_memory
+
+# The dithering engine lives next to the still-image script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "image"))
+from dither import ALGORITHMS, bits_to_transparent, dither, resize_bits
+from gif_writer import GifWriter
 
 def calculate_new_size(image, dpi):
     width, height = image.size
@@ -10,100 +20,176 @@ def calculate_new_size(image, dpi):
     new_width = int(aspect_ratio * new_height)
     return (new_width, new_height)
 
-def process_frame(frame, new_size):
+def dither_frame(frame, new_size, algorithm="pil"):
+    """Dither a frame to a bool array (True = white) of exactly new_size."""
+    frame = frame.convert('L')
     frame.thumbnail(new_size, Image.NEAREST)
-    frame = frame.convert('L').convert('1').convert('RGBA')
-
-    data = np.array(frame)
-    red, green, blue, alpha = data[:,:,0], data[:,:,1], data[:,:,2], data[:,:,3]
-    white_areas = (red > 200) & (green > 200) & (blue > 200)
-    data[white_areas] = [255, 255, 255, 0]
-    frame = Image.fromarray(data)
-    frame = frame.resize(new_size, Image.NEAREST)
-
-    return frame
-
-def is_frame_empty(frame, threshold=0.05, variance_threshold=4):
-    # Convert the frame to grayscale
-    grayscale = frame.convert('L')
-    np_image = np.array(grayscale)
-
-    # Calculate the variance
-    variance = np.var(np_image)
-    return variance < variance_threshold
-
-def process_gif(filename, output_folder, dpi=300, specified_size=None):
-    with Image.open(filename) as image:
-        print("Loading " + filename + "...")
-
-        new_size = specified_size if specified_size else calculate_new_size(image, dpi)
-        frames = []
-        for frame in ImageSequence.Iterator(image):
-            processed_frame = process_frame(frame.copy(), new_size)
-            if not is_frame_empty(processed_frame):
-                frames.append(processed_frame)
-
-        if len(frames) > 1:
-            # Remove the first frame after processing
-            frames.pop(0)
-        else:
-            print("Not enough frames to remove the first one in " + filename)
-            return
-
-        if not frames:
-            print("No valid frames found in " + filename)
-            return
-
-        output_filename = os.path.splitext(os.path.basename(filename))[0] + "_dithered.gif"
-        output_filename = os.path.join(output_folder, output_filename)
-
-        frames[0].save(output_filename, save_all=True, append_images=frames[1:], loop=0, duration=image.info['duration'], disposal=2)
-        print("Saving " + output_filename)
-    with Image.open(filename) as image:
-        print("Loading " + filename + "...")
-
-        new_size = specified_size if specified_size else calculate_new_size(image, dpi)
-        frames = []
-        for i, frame in enumerate(ImageSequence.Iterator(image)):
-            # Skip the first frame
-            if i == 0:
-                continue
-
-            processed_frame = process_frame(frame.copy(), new_size)
-
-            # Apply the empty frame check
-            if not is_frame_empty(processed_frame):
-                frames.append(processed_frame)
-
-        if not frames:
-            print("No valid frames found in " + filename)
-            return
-
-        output_filename = os.path.splitext(os.path.basename(filename))[0] + "_dithered.gif"
-        output_filename = os.path.join(output_folder, output_filename)
+    return resize_bits(dither(frame, algorithm), new_size)
+
+def is_frame_empty(bits, threshold=0.0, variance_threshold=4, sample_stride=1, confidence=3.0):
+    """Decide whether a dithered frame is blank, from its 1-bit data alone.
+
+    A binary frame whose minority colour covers a fraction q of its pixels has
+    grayscale variance 255**2 * q * (1 - q), so the old full-resolution
+    np.var test reduces to a pixel count. The frame is empty when q is below
+    `threshold` or the implied variance is below `variance_threshold`.
+
+    With sample_stride > 1 only every stride-th pixel in each direction is
+    counted first. If the Wilson interval for q at `confidence` standard
+    deviations lies wholly on one side of the limit, that settles it;
+    otherwise (always the case for a near-blank frame with threshold 0) every
+    pixel is counted. Counting works on strided views, so no memory is
+    allocated either way.
+    """
+    if bits.size == 0:
+        return True
+    # Minority fraction at which 255**2 * q * (1 - q) reaches variance_threshold
+    variance_limit = (1 - np.sqrt(max(0.0, 1 - 4 * variance_threshold / 255 ** 2))) / 2
+    limit = max(threshold, variance_limit)
+
+    if sample_stride > 1:
+        sample = bits[::sample_stride, ::sample_stride]
+        total = sample.size
+        q = np.count_nonzero(sample) / total
+        q = min(q, 1 - q)
+        z2 = confidence * confidence
+        centre = (q + z2 / (2 * total)) / (1 + z2 / total)
+        margin = confidence * np.sqrt(q * (1 - q) / total + z2 / (4 * total * total)) / (1 + z2 / total)
+        if centre + margin < limit:
+            return True
+        if centre - margin >= limit:
+            return False
+
+    q = np.count_nonzero(bits) / bits.size
+    return min(q, 1 - q) < limit
+
+def decoded_frames(image, skip_first=False):
+    """Yield (frame, duration) for each frame of an open GIF."""
+    default_duration = image.info.get('duration', 100)
+    for i, frame in enumerate(ImageSequence.Iterator(image)):
+        if skip_first and i == 0:
+            continue
+        yield frame, frame.info.get('duration', default_duration)
+
+def dithered_frames(image, new_size, algorithm="pil", skip_first=False):
+    """Yield (bits, duration) for each frame, dithering in this process."""
+    for frame, duration in decoded_frames(image, skip_first):
+        yield dither_frame(frame, new_size, algorithm), duration
+
+_worker = {}
+
+def init_frame_worker(input_name, output_name, input_shape, output_shape, algorithm):
+    # Pool workers share the parent's resource tracker, so attaching here
+    # does not change who unlinks the blocks
+    _worker["input_shm"] = shared_memory.SharedMemory(name=input_name)
+    _worker["output_shm"] = shared_memory.SharedMemory(name=output_name)
+    _worker["inputs"] = np.ndarray(input_shape, dtype=np.uint8, buffer=_worker["input_shm"].buf)
+    _worker["outputs"] = np.ndarray(output_shape, dtype=bool, buffer=_worker["output_shm"].buf)
+    _worker["algorithm"] = algorithm
+
+def dither_slot(slot):
+    """Dither the grayscale frame in input slot `slot` into the matching output slot."""
+    outputs = _worker["outputs"]
+    height, width = outputs.shape[1:]
+    frame = Image.fromarray(_worker["inputs"][slot])
+    outputs[slot] = dither_frame(frame, (width, height), _worker["algorithm"])
+    return slot
+
+def dithered_frames_parallel(image, new_size, algorithm="pil", skip_first=False, workers=2, chunk_frames=None):
+    """Yield (bits, duration) for each frame, dithering across a process pool.
+
+    GIF decoding is sequential, so this process decodes frames to grayscale
+    into one half of a shared-memory ring while the workers dither the other
+    half. Frames go to and from the workers as slots in shared NumPy buffers,
+    never as pickled images, and come back in their original order. Memory is
+    bounded by 2 * chunk_frames frames.
+
+    The yielded arrays are views into shared memory and are only valid until
+    the next frame is requested.
+    """
+    chunk_frames = chunk_frames or 4 * workers
+    width, height = image.size
+    out_width, out_height = new_size
+    input_shape = (2 * chunk_frames, height, width)
+    output_shape = (2 * chunk_frames, out_height, out_width)
+
+    input_shm = shared_memory.SharedMemory(create=True, size=int(np.prod(input_shape)))
+    output_shm = shared_memory.SharedMemory(create=True, size=int(np.prod(output_shape)))
+    try:
+        inputs = np.ndarray(input_shape, dtype=np.uint8, buffer=input_shm.buf)
+        outputs = np.ndarray(output_shape, dtype=bool, buffer=output_shm.buf)
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_frame_worker,
+                                 initargs=(input_shm.name, output_shm.name, input_shape, output_shape,
+                                           algorithm)) as executor:
+            frames = decoded_frames(image, skip_first)
+            pending = []
+            half = 0
+            while True:
+                # Decode the next chunk into the free half while the workers
+                # are busy with the previous one
+                base = half * chunk_frames
+                submitted = []
+                for slot, (frame, duration) in enumerate(islice(frames, chunk_frames), base):
+                    inputs[slot] = np.asarray(frame.convert('L'))
+                    submitted.append((executor.submit(dither_slot, slot), duration))
+
+                for future, duration in pending:
+                    yield outputs[future.result()], duration
+
+                if not submitted:
+                    break
+                pending = submitted
+                half = 1 - half
+    finally:
+        del inputs, outputs
+        input_shm.close()
+        input_shm.unlink()
+        output_shm.close()
+        output_shm.unlink()
+
+def process_gif(filename, output_folder, dpi=300, specified_size=None, algorithm="pil", skip_first=False,
+                workers=1, chunk_frames=None, empty_threshold=0.0, empty_variance=4, empty_sample_stride=1,
+                empty_confidence=3.0):
+    """Dither a GIF one frame at a time.
+
+    Each frame is dithered, checked for emptiness and appended to the output
+    file as soon as it is ready, so memory does not grow with the number of
+    frames. Frames keep their own duration. With workers > 1 frames are
+    dithered in parallel in bounded chunks.
+    """
+    output_filename = os.path.splitext(os.path.basename(filename))[0] + "_dithered.gif"
+    output_filename = os.path.join(output_folder, output_filename)
 
-        # Save the GIF, starting from what was originally the second frame
-        frames[0].save(output_filename, save_all=True, append_images=frames[1:], loop=0, duration=image.info['duration'], disposal=2)
-        print("Saving " + output_filename)
     with Image.open(filename) as image:
         print("Loading " + filename + "...")
 
         new_size = specified_size if specified_size else calculate_new_size(image, dpi)
-        frames = []
-        for frame in ImageSequence.Iterator(image):
-            processed_frame = process_frame(frame.copy(), new_size)
-            if not is_frame_empty(processed_frame):
-                frames.append(processed_frame)
 
-        if not frames:
-            print("No valid frames found in " + filename)
-            return
-
-        output_filename = os.path.splitext(os.path.basename(filename))[0] + "_dithered.gif"
-        output_filename = os.path.join(output_folder, output_filename)
-
-        frames[0].save(output_filename, save_all=True, append_images=frames[1:], loop=0, duration=image.info['duration'], disposal=2)
-        print("Saving " + output_filename)
+        if workers > 1:
+            frames = dithered_frames_parallel(image, new_size, algorithm, skip_first, workers, chunk_frames)
+        else:
+            frames = dithered_frames(image, new_size, algorithm, skip_first)
+
+        dropped = 0
+        detection_time = 0.0
+        with GifWriter(output_filename) as writer:
+            for bits, duration in frames:
+                start = time.perf_counter()
+                empty = is_frame_empty(bits, empty_threshold, empty_variance, empty_sample_stride, empty_confidence)
+                detection_time += time.perf_counter() - start
+                if empty:
+                    dropped += 1
+                    continue
+                writer.append(bits_to_transparent(bits, mode="P"), duration)
+
+    print(f"Dropped {dropped} of {dropped + writer.frame_count} frames as empty "
+          f"(detection took {detection_time * 1000:.1f} ms)")
+    if writer.frame_count == 0:
+        print("No valid frames found in " + filename)
+        return
+
+    print(f"Saving {output_filename} ({writer.frame_count} frames)")
 
 def main():
     parser = argparse.ArgumentParser(description="Process GIFs in a folder")
@@ -111,6 +197,23 @@ def main():
     parser.add_argument("output_folder", help="Path to the output folder for processed images")
     parser.add_argument("--dpi", type=int, default=300, help="DPI for resizing images (default: 300)")
     parser.add_argument("--size", type=int, nargs=2, metavar=("WIDTH", "HEIGHT"), help="Specific size for resizing images")
+    parser.add_argument("--algorithm", choices=ALGORITHMS, default="pil",
+                        help="Dithering algorithm, see image/dither.py (default: pil)")
+    parser.add_argument("--skip-first-frame", action="store_true",
+                        help="Drop the first frame of each GIF")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes for per-frame dithering; 0 uses every core (default: 1)")
+    parser.add_argument("--chunk-frames", type=int,
+                        help="Frames handed to the pool at a time (default: 4 per worker)")
+    parser.add_argument("--empty-threshold", type=float, default=0.0,
+                        help="Drop frames whose minority colour covers less than this fraction (default: 0)")
+    parser.add_argument("--empty-variance", type=float, default=4,
+                        help="Drop frames whose grayscale variance is below this (default: 4)")
+    parser.add_argument("--empty-sample-stride", type=int, default=1,
+                        help="Sample every Nth pixel per axis first in the empty check; frames the sample "
+                             "cannot settle are counted in full (default: 1, always count in full)")
+    parser.add_argument("--empty-confidence", type=float, default=3.0,
+                        help="Standard deviations of margin when --empty-sample-stride > 1; 0 trusts the sample (default: 3)")
 
     args = parser.parse_args()
 
@@ -121,11 +224,16 @@ def main():
         os.makedirs(output_folder)
 
     files = os.listdir(input_folder)
+    workers = args.workers if args.workers > 0 else os.cpu_count()
 
     for filename in files:
         if filename.lower().endswith('.gif'):
             specified_size = tuple(args.size) if args.size else None
-            process_gif(os.path.join(input_folder, filename), output_folder, dpi=args.dpi, specified_size=specified_size)
+            process_gif(os.path.join(input_folder, filename), output_folder, dpi=args.dpi, specified_size=specified_size,
+                        algorithm=args.algorithm, skip_first=args.skip_first_frame,
+                        workers=workers, chunk_frames=args.chunk_frames, empty_threshold=args.empty_threshold,
+                        empty_variance=args.empty_variance, empty_sample_stride=args.empty_sample_stride,
+                        empty_confidence=args.empty_confidence)
             print("Processed " + filename)
 
 if __name__ == "__main__":
@@ -0,0 +1,94 @@
+"""Global GIF palettes and vectorized colour mapping.
+
+Instead of quantizing every frame to its own adaptive palette, build one
+255-colour palette from a sample of frames and map every frame to it with a
+precomputed nearest-colour lookup table. Index 255 is reserved for
+transparency.
+"""
+from PIL import Image
+import numpy as np
+
+TRANSPARENT_INDEX = 255
+
+# Bits per channel kept by the lookup table (64 levels, 262144 entries)
+LUT_BITS = 6
+
+
+def sample_indices(count, samples):
+    """Evenly spaced frame indices, at most `samples` of them."""
+    if count <= samples:
+        return list(range(count))
+    return sorted(set(np.linspace(0, count - 1, samples).round().astype(int).tolist()))
+
+
+def build_palette(frames, colors=255, max_pixels=1_000_000, alpha_cutoff=128, seed=0):
+    """Median-cut a palette from the opaque pixels of a few RGBA arrays.
+
+    Returns a (colors, 3) uint8 array. Pixels are randomly subsampled so the
+    quantizer never sees more than max_pixels of them.
+    """
+    rng = np.random.default_rng(seed)
+    per_frame = max(1, max_pixels // max(1, len(frames)))
+    pixels = []
+    for rgba in frames:
+        opaque = rgba[rgba[:, :, 3] >= alpha_cutoff][:, :3]
+        if len(opaque) > per_frame:
+            opaque = opaque[rng.choice(len(opaque), per_frame, replace=False)]
+        pixels.append(opaque)
+
+    pixels = np.concatenate(pixels) if pixels else np.zeros((0, 3), dtype=np.uint8)
+    if len(pixels) == 0:
+        return np.zeros((colors, 3), dtype=np.uint8)
+
+    strip = Image.fromarray(np.ascontiguousarray(pixels[None, :, :]))
+    quantized = strip.quantize(colors=colors, method=Image.Quantize.MEDIANCUT)
+    palette = np.array(quantized.getpalette()[:colors * 3], dtype=np.uint8).reshape(-1, 3)
+    if len(palette) < colors:
+        palette = np.vstack([palette, np.zeros((colors - len(palette), 3), dtype=np.uint8)])
+    return palette
+
+
+def palette_bytes(palette):
+    """Flat 256-entry RGB palette for a GIF colour table; entry 255 is the transparent slot."""
+    table = np.zeros((256, 3), dtype=np.uint8)
+    table[:len(palette)] = palette
+    return table.tobytes()
+
+
+class PaletteMapper:
+    """Map RGBA frames to a fixed palette with a single table lookup per pixel.
+
+    The table covers the RGB cube at LUT_BITS per channel and is filled once
+    with the nearest palette entry for each cell centre. Squared distances are
+    expanded to |p|^2 - 2 c.p (|c|^2 does not change the argmin), so the fill
+    is one matrix product per chunk.
+    """
+
+    def __init__(self, palette, alpha_cutoff=128, chunk=65536):
+        self.palette = palette
+        self.alpha_cutoff = alpha_cutoff
+        levels = 1 << LUT_BITS
+        shift = 8 - LUT_BITS
+
+        grid = (np.arange(levels, dtype=np.float32) * (1 << shift)) + (1 << shift) // 2
+        r, g, b = np.meshgrid(grid, grid, grid, indexing="ij")
+        centres = np.stack([r.ravel(), g.ravel(), b.ravel()], axis=1)
+
+        entries = palette.astype(np.float32)
+        norms = (entries ** 2).sum(axis=1)
+        self.lut = np.empty(len(centres), dtype=np.uint8)
+        for start in range(0, len(centres), chunk):
+            distances = norms - 2 * (centres[start:start + chunk] @ entries.T)
+            self.lut[start:start + chunk] = distances.argmin(axis=1)
+
+    def map(self, rgba):
+        """Return a (height, width) uint8 index array for an RGBA array."""
+        shift = 8 - LUT_BITS
+        key = (rgba[:, :, 0] >> shift).astype(np.int32)
+        key <<= LUT_BITS
+        key |= rgba[:, :, 1] >> shift
+        key <<= LUT_BITS
+        key |= rgba[:, :, 2] >> shift
+        indices = self.lut[key]
+        indices[rgba[:, :, 3] < self.alpha_cutoff] = TRANSPARENT_INDEX
+        return indices
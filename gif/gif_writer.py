@@ -0,0 +1,218 @@
+"""Append-only GIF writer.
+
+PIL's save(save_all=True) needs every frame in memory at once. GifWriter
+writes the header when the first frame arrives and encodes each frame to
+disk as soon as it is appended, so memory stays at one frame no matter how
+long the animation is. Frames carry their own duration, disposal and
+transparency.
+
+    with GifWriter("out.gif") as writer:
+        for frame, duration in frames:
+            writer.append(frame, duration)
+
+DeltaGifWriter takes frames already mapped to one global palette and only
+writes the rectangle that changed since the previous frame.
+"""
+from PIL import Image, GifImagePlugin
+import numpy as np
+import os
+import struct
+
+
+def to_palette_frame(frame):
+    """Return (P-mode image, transparency index or None) for any input frame.
+
+    RGBA frames are quantized to 255 colours and fully transparent pixels are
+    mapped to index 255.
+    """
+    if frame.mode == "P":
+        return frame, frame.info.get("transparency")
+
+    if frame.mode in ("RGBA", "LA", "PA"):
+        rgba = frame.convert("RGBA")
+        frame = rgba.convert("RGB").convert("P", palette=Image.ADAPTIVE, colors=255)
+        indices = np.array(frame)
+        indices[np.asarray(rgba)[:, :, 3] == 0] = 255
+        palette = frame.getpalette()[:255 * 3]
+        palette += [0] * (255 * 3 - len(palette)) + [0, 0, 0]
+        frame = Image.fromarray(indices)
+        frame.putpalette(palette)
+        return frame, 255
+
+    return frame.convert("RGB").convert("P", palette=Image.ADAPTIVE, colors=256), None
+
+
+class GifWriter:
+    """Stream frames into a GIF file one at a time.
+
+    Output goes to a temporary file next to path and is moved into place by
+    close(), so an interrupted run never leaves a truncated GIF behind. If no
+    frame is ever appended, nothing is written.
+    """
+
+    def __init__(self, path, loop=0, palette=None):
+        self.path = path
+        self.loop = loop
+        self.palette = palette
+        self.size = None
+        self.frame_count = 0
+        self._temp_path = f"{path}.{os.getpid()}.part"
+        self._fp = None
+        self._frame_spans = []
+
+    def _write_header(self, size):
+        self.size = size
+        self._fp = open(self._temp_path, "wb")
+        if self.palette is None:
+            # Logical screen descriptor without a global colour table; every
+            # frame carries its own local table
+            self._fp.write(b"GIF89a" + struct.pack("<HHBBB", size[0], size[1], 0, 0, 0))
+        else:
+            # 256-entry global colour table, background set to the last entry
+            self._fp.write(b"GIF89a" + struct.pack("<HHBBB", size[0], size[1], 0x87, 255, 0))
+            self._fp.write(bytes(self.palette))
+        if self.loop is not None:
+            self._fp.write(b"!\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", self.loop) + b"\x00")
+
+    def append(self, frame, duration, disposal=2, offset=(0, 0)):
+        """Encode one frame and write it to disk. duration is in milliseconds."""
+        if self._fp is None:
+            self._write_header(frame.size)
+
+        frame, transparency = to_palette_frame(frame)
+        self._write_frame(frame, duration, disposal, offset, transparency, local_palette=True)
+
+    def _write_frame(self, frame, duration, disposal, offset, transparency, local_palette):
+        params = {"duration": duration, "disposal": disposal, "include_color_table": local_palette}
+        if transparency is not None:
+            params["transparency"] = transparency
+        start = self._fp.tell()
+        for chunk in GifImagePlugin.getdata(frame, offset, **params):
+            self._fp.write(chunk)
+        self._frame_spans.append((start, self._fp.tell()))
+        self.frame_count += 1
+
+    def repeat_frames(self, indices):
+        """Append copies of frames already written, by index, without re-encoding.
+
+        Frames written by append() are self-contained (own palette, full
+        disposal), so their encoded bytes can be replayed as they are, e.g.
+        for ping-pong playback. Does nothing if no frame has been written.
+        """
+        if self.frame_count == 0:
+            return
+        self._fp.flush()
+        with open(self._temp_path, "rb") as source:
+            for index in indices:
+                start, end = self._frame_spans[index]
+                source.seek(start)
+                position = self._fp.tell()
+                self._fp.write(source.read(end - start))
+                self._frame_spans.append((position, self._fp.tell()))
+                self.frame_count += 1
+
+    def close(self):
+        """Finish the file and move it into place."""
+        if self._fp is None:
+            return
+        self._fp.write(b";")
+        self._fp.close()
+        self._fp = None
+        os.replace(self._temp_path, self.path)
+
+    def abort(self):
+        """Drop everything written so far."""
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def bounding_box(mask):
+    """(left, top, right, bottom) of the True pixels in mask, or None."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if len(rows) == 0:
+        return None
+    cols = np.flatnonzero(mask[rows[0]:rows[-1] + 1].any(axis=0))
+    return cols[0], rows[0], cols[-1] + 1, rows[-1] + 1
+
+
+class DeltaGifWriter(GifWriter):
+    """Stream palette-index frames, writing only what changed.
+
+    Frames are (height, width) uint8 arrays of indices into the global
+    palette, with `transparency` marking transparent pixels. Each frame is
+    cropped to the rectangle that differs from what is already on screen,
+    and unchanged pixels inside it are written as transparent so they show
+    through and compress well.
+
+    One frame is held back so its disposal can be chosen once the next frame
+    is known: normally the canvas is left in place (disposal 1), but if the
+    next frame turns visible pixels transparent the held frame is written to
+    cover everything visible and restores to background (disposal 2).
+    Identical consecutive frames are merged by extending the duration.
+    """
+
+    def __init__(self, path, palette, loop=0, transparency=255):
+        super().__init__(path, loop=loop, palette=palette)
+        self.transparency = transparency
+        self.pixels_skipped = 0
+        self._pending = None
+        self._canvas = None
+
+    def append_indices(self, indices, duration):
+        if self._pending is None:
+            height, width = indices.shape
+            self._write_header((width, height))
+            self._canvas = np.full(indices.shape, self.transparency, dtype=np.uint8)
+            self._pending = [indices, duration]
+            return
+
+        previous = self._pending[0]
+        if np.array_equal(indices, previous):
+            self._pending[1] += duration
+            return
+
+        reveal = np.any((indices == self.transparency) & (previous != self.transparency))
+        self._flush(restore=bool(reveal))
+        self._pending = [indices, duration]
+
+    def _flush(self, restore):
+        indices, duration = self._pending
+        changed = indices != self._canvas
+        cover = changed | (indices != self.transparency) if restore else changed
+        left, top, right, bottom = bounding_box(cover) or (0, 0, 1, 1)
+
+        region = indices[top:bottom, left:right].copy()
+        region[~changed[top:bottom, left:right]] = self.transparency
+        frame = Image.frombuffer("P", (right - left, bottom - top), region, "raw", "P", 0, 1)
+        self._write_frame(frame, duration, 2 if restore else 1, (left, top), self.transparency,
+                          local_palette=False)
+        self.pixels_skipped += indices.size - region.size
+
+        if restore:
+            self._canvas = np.full(indices.shape, self.transparency, dtype=np.uint8)
+        else:
+            self._canvas = indices
+        self._pending = None
+
+    def repeat_frames(self, indices):
+        # Each delta frame only holds what changed since the frame before it,
+        # so replaying one anywhere else would draw over the wrong canvas
+        raise TypeError("DeltaGifWriter does not support repeating frames (e.g. ping-pong); "
+                        "use GifWriter, whose frames are self-contained")
+
+    def close(self):
+        if self._pending is not None:
+            self._flush(restore=False)
+        super().close()
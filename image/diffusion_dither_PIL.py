@@ -1,7 +1,14 @@
 from PIL import Image
-import numpy as np
 import os
+import sys
+import time
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from dither import ALGORITHMS, bits_to_transparent, dither, resize_bits
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff', '.tif', '.webp')
 
 def calculate_new_size(image, dpi):
     width, height = image.size
@@ -11,7 +18,19 @@ def calculate_new_size(image, dpi):
     new_width = int(aspect_ratio * new_height)
     return (new_width, new_height)
 
-def process_image(filename, output_folder, dpi=300, specified_size=None, invert=False):
+RESAMPLE_FILTERS = {
+    "nearest": Image.NEAREST,
+    "box": Image.BOX,
+    "bilinear": Image.BILINEAR,
+    "hamming": Image.HAMMING,
+    "bicubic": Image.BICUBIC,
+    "lanczos": Image.LANCZOS,
+}
+
+OUTPUT_MODES = ("RGBA", "LA", "P")
+
+def process_image(filename, output_folder, dpi=300, specified_size=None, invert=False, output_name=None,
+                  resample="nearest", mode="RGBA", algorithm="pil"):
     # Load the image
     image = Image.open(filename)
     print("Loading " + filename + "...")
@@ -22,95 +41,78 @@ def process_image(filename, output_folder, dpi=300, specified_size=None, invert=
     else:
         new_size = calculate_new_size(image, dpi)
 
-    # Resize the image while preserving aspect ratio
-    image.thumbnail(new_size, Image.BILINEAR)
+    # Resize the image while preserving aspect ratio (thumbnail lets JPEG
+    # decode at a reduced scale in its own mode, as the original script did)
+    image.thumbnail(new_size, RESAMPLE_FILTERS[resample])
     print(f"Resizing to {new_size} with aspect ratio preserved...")
 
     # Convert the image to grayscale
     image = image.convert('L')
 
-    # Dither the image
-    image = image.convert('1')
-    print("Dithering...")
-
-    # Convert the image back to RGB
-    image = image.convert('RGB')
+    # Dither the image, then stretch the 1-bit result to the exact size using
+    # nearest neighbor while it is still 1 byte per pixel
+    bits = dither(image, algorithm)
+    print(f"Dithering ({algorithm})...")
+    bits = resize_bits(bits, new_size)
 
-    # Make sure the image has an alpha channel
-    image = image.convert('RGBA')
-
-    # Convert white (also shades of whites) pixels to transparent, or invert logic based on argument
-    data = np.array(image)
-    red, green, blue, alpha = data[:,:,0], data[:,:,1], data[:,:,2], data[:,:,3]
-
-    if invert:
-        # Make non-white areas transparent
-        non_white_areas = (red <= 200) | (green <= 200) | (blue <= 200)
-        data[non_white_areas] = [0, 0, 0, 0]
-    else:
-        # Make white areas transparent
-        white_areas = (red > 200) & (green > 200) & (blue > 200)
-        data[white_areas] = [255, 255, 255, 0]
-
-    image = Image.fromarray(data)
-    # Resize the image (post-dither) using nearest neighbor
-    image = image.resize(new_size, Image.NEAREST)
+    # Convert white pixels to transparent, or invert logic based on argument
+    image = bits_to_transparent(bits, invert=invert, mode=mode)
 
     # Save the image
-    output_filename = os.path.splitext(os.path.basename(filename))[0] + ".png"
-    output_filename = os.path.join(output_folder, output_filename)
+    if output_name is None:
+        output_name = os.path.splitext(os.path.basename(filename))[0] + ".png"
+    output_filename = os.path.join(output_folder, output_name)
     image.save(output_filename)
     print("Saving " + output_filename)
-    # Load the image
-    image = Image.open(filename)
-    print("Loading " + filename + "...")
-
-    # Determine the new size
-    if specified_size:
-        new_size = specified_size
-    else:
-        new_size = calculate_new_size(image, dpi)
-
-    # Resize the image while preserving aspect ratio
-    image.thumbnail(new_size, Image.NEAREST)
-    print(f"Resizing to {new_size} with aspect ratio preserved...")
+    return output_filename
 
-    # Convert the image to grayscale
-    image = image.convert('L')
-
-    # Dither the image
-    image = image.convert('1')
-    print("Dithering...")
-
-    # Convert the image back to RGB
-    image = image.convert('RGB')
-
-    # Make sure the image has an alpha channel
-    image = image.convert('RGBA')
+def output_names_for(files):
+    """Map each input file name to its output name.
 
-    # Convert white (also shades of whites) pixels to transparent, or invert logic based on argument
-    data = np.array(image)
-    red, green, blue, alpha = data[:,:,0], data[:,:,1], data[:,:,2], data[:,:,3]
-
-    if invert:
-        # Make non-white areas transparent
-        non_white_areas = (red <= 200) | (green <= 200) | (blue <= 200)
-        data[non_white_areas] = [0, 0, 0, 0]
-    else:
-        # Make white areas transparent
-        white_areas = (red > 200) & (green > 200) & (blue > 200)
-        data[white_areas] = [255, 255, 255, 0]
-
-    image = Image.fromarray(data)
-
-    # Resize the image (post-dither) using nearest neighbor
-    image = image.resize(new_size, Image.NEAREST)
+    Names are derived from the sorted input list only, so they do not depend on
+    which worker finishes first. Inputs that share a stem (e.g. scan.jpg and
+    scan.tif) keep their extension in the output name instead of overwriting
+    each other.
+    """
+    stems = {}
+    for filename in files:
+        stem = os.path.splitext(filename)[0]
+        stems[stem] = stems.get(stem, 0) + 1
 
-    # Save the image
-    output_filename = os.path.splitext(os.path.basename(filename))[0] + ".png"
-    output_filename = os.path.join(output_folder, output_filename)
-    image.save(output_filename)
-    print("Saving " + output_filename)
+    names = {}
+    for filename in files:
+        stem, ext = os.path.splitext(filename)
+        if stems[stem] > 1:
+            names[filename] = f"{stem}_{ext.lstrip('.').lower()}.png"
+        else:
+            names[filename] = stem + ".png"
+    return names
+
+def process_image_safe(input_path, output_folder, output_name, dpi, specified_size, invert, resample, mode,
+                       algorithm):
+    """Run process_image and return (input_path, bytes_read, error) instead of raising."""
+    try:
+        size = os.path.getsize(input_path)
+        process_image(input_path, output_folder, dpi=dpi, specified_size=specified_size,
+                      invert=invert, output_name=output_name, resample=resample, mode=mode,
+                      algorithm=algorithm)
+        return input_path, size, None
+    except Exception as e:
+        return input_path, 0, f"{type(e).__name__}: {e}"
+
+def pool_result(future, input_path):
+    """future.result() of a process_image_safe job, with a crashed worker recorded as that input's failure."""
+    try:
+        return future.result()
+    except BrokenProcessPool as e:
+        return input_path, 0, f"worker process died: {e}"
+
+def print_summary(processed, failed, total_bytes, elapsed):
+    elapsed = max(elapsed, 1e-9)
+    mb = total_bytes / (1024 * 1024)
+    print("-" * 50)
+    print(f"Processed {processed} files ({failed} failed) in {elapsed:.2f}s")
+    print(f"Throughput: {processed / elapsed:.2f} files/s, {mb / elapsed:.2f} MB/s")
 
 def main():
     parser = argparse.ArgumentParser(description="Process images in a folder")
@@ -123,8 +125,14 @@ def main():
                         help="Specific size for resizing images (overrides DPI setting)")
     parser.add_argument("--invert", type=lambda x: (str(x).lower() == 'true'), default=False,
                     help="Invert which pixels become transparent (default: False)")
-
-
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes; 0 uses every core (default: 1)")
+    parser.add_argument("--resample", choices=sorted(RESAMPLE_FILTERS), default="nearest",
+                        help="Resampling filter for the pre-dither resize (default: nearest)")
+    parser.add_argument("--mode", choices=OUTPUT_MODES, default="RGBA",
+                        help="Output image mode; LA and P write smaller files (default: RGBA)")
+    parser.add_argument("--algorithm", choices=ALGORITHMS, default="pil",
+                        help="Dithering algorithm, see dither.py (default: pil)")
 
     args = parser.parse_args()
 
@@ -134,18 +142,49 @@ def main():
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    # Get a list of all files in the input directory
-    files = os.listdir(input_folder)
+    # Get a sorted list of all image files in the input directory
+    files = sorted(f for f in os.listdir(input_folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+    output_names = output_names_for(files)
 
-    # Loop over all files
-    for filename in files:
-        if filename.endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff', '.tif', '.webp')):
-            # Check if specific size is provided, otherwise set to None
-            specified_size = tuple(args.size) if args.size else None
+    # Check if specific size is provided, otherwise set to None
+    specified_size = tuple(args.size) if args.size else None
+    workers = args.workers if args.workers > 0 else os.cpu_count()
+
+    jobs = [(os.path.join(input_folder, f), output_folder, output_names[f], args.dpi, specified_size, args.invert,
+             args.resample, args.mode, args.algorithm)
+            for f in files]
 
-            # Process the image
-            process_image(os.path.join(input_folder, filename), output_folder, dpi=args.dpi, specified_size=specified_size, invert=args.invert)
-            print("Processed " + filename)
+    processed = 0
+    failures = []
+    total_bytes = 0
+    start = time.perf_counter()
+
+    if workers == 1:
+        results = (process_image_safe(*job) for job in jobs)
+    else:
+        print(f"Processing {len(jobs)} files with {workers} workers...")
+        executor = ProcessPoolExecutor(max_workers=workers)
+        futures = {executor.submit(process_image_safe, *job): job[0] for job in jobs}
+        # Once a worker dies every unfinished job fails the same way and is
+        # reported like any other error
+        results = (pool_result(future, futures[future]) for future in as_completed(futures))
+
+    try:
+        for input_path, size, error in results:
+            if error:
+                failures.append((input_path, error))
+                print(f"Failed {os.path.basename(input_path)}: {error}")
+            else:
+                processed += 1
+                total_bytes += size
+                print("Processed " + os.path.basename(input_path))
+    finally:
+        if workers != 1:
+            executor.shutdown()
+
+    print_summary(processed, len(failures), total_bytes, time.perf_counter() - start)
+    if failures:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
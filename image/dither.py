@@ -0,0 +1,366 @@
+"""Shared 1-bit dithering engine for the image and gif dither scripts.
+
+Every algorithm takes a 2-D uint8 grayscale array (or an 'L' image) and
+returns a 2-D bool array where True means white.
+
+  pil              PIL's built-in convert('1') (Floyd-Steinberg, in C)
+  floyd-steinberg  error diffusion, wavefront-vectorized or Numba-compiled
+  atkinson         error diffusion, wavefront-vectorized or Numba-compiled
+  bayer            ordered dithering with an 8x8 Bayer matrix
+  blue-noise       ordered dithering with a 64x64 void-and-cluster mask
+
+Run this file directly to benchmark megapixels/s per kernel:
+
+    python image/dither.py --sizes 4k 8k 16k
+"""
+from PIL import Image
+import numpy as np
+import argparse
+import time
+from functools import lru_cache
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# Error diffusion kernels as (dy, dx, weight) taps relative to the current pixel
+DIFFUSION_KERNELS = {
+    "floyd-steinberg": [(0, 1, 7 / 16), (1, -1, 3 / 16), (1, 0, 5 / 16), (1, 1, 1 / 16)],
+    "atkinson": [(0, 1, 1 / 8), (0, 2, 1 / 8), (1, -1, 1 / 8), (1, 0, 1 / 8), (1, 1, 1 / 8), (2, 0, 1 / 8)],
+}
+
+ALGORITHMS = ("pil", "floyd-steinberg", "atkinson", "bayer", "blue-noise")
+
+# Rows per band for the vectorized diffusion path; bounds the skewed buffer
+# to roughly (width + 2 * BAND_ROWS) * BAND_ROWS floats
+BAND_ROWS = 1024
+
+
+def bayer_matrix(n=8):
+    """Return an n x n Bayer index matrix (n a power of two)."""
+    matrix = np.zeros((1, 1), dtype=np.int64)
+    while matrix.shape[0] < n:
+        matrix = np.block([[4 * matrix, 4 * matrix + 2],
+                           [4 * matrix + 3, 4 * matrix + 1]])
+    return matrix
+
+
+@lru_cache(maxsize=None)
+def blue_noise_matrix(size=64, sigma=1.5, seed=0):
+    """Return a size x size blue-noise rank matrix built with void-and-cluster.
+
+    Energy is a wrapped Gaussian filter of the binary pattern, updated
+    incrementally by rolling a precomputed kernel, so the whole mask builds in
+    well under a second for the default 64x64.
+    """
+    rng = np.random.default_rng(seed)
+    n = size * size
+
+    offsets = np.arange(size)
+    offsets = np.minimum(offsets, size - offsets)
+    kernel = np.exp(-(offsets[:, None] ** 2 + offsets[None, :] ** 2) / (2 * sigma ** 2))
+
+    def energy_of(pattern):
+        return np.real(np.fft.ifft2(np.fft.fft2(pattern) * np.fft.fft2(kernel)))
+
+    def splat(energy, index, sign):
+        y, x = divmod(index, size)
+        energy += sign * np.roll(np.roll(kernel, y, axis=0), x, axis=1)
+
+    # Initial binary pattern: ~10% random points relaxed until the tightest
+    # cluster and the largest void coincide
+    pattern = np.zeros((size, size), dtype=bool)
+    pattern.flat[rng.choice(n, n // 10, replace=False)] = True
+    energy = energy_of(pattern.astype(np.float64))
+    while True:
+        cluster = int(np.argmax(np.where(pattern, energy, -np.inf)))
+        pattern.flat[cluster] = False
+        splat(energy, cluster, -1)
+        void = int(np.argmin(np.where(pattern, np.inf, energy)))
+        if void == cluster:
+            pattern.flat[cluster] = True
+            splat(energy, cluster, 1)
+            break
+        pattern.flat[void] = True
+        splat(energy, void, 1)
+
+    initial = pattern.copy()
+    initial_energy = energy.copy()
+    ones = int(initial.sum())
+    ranks = np.zeros(n, dtype=np.int64)
+
+    # Phase 1: peel the tightest clusters off the initial pattern
+    for rank in range(ones - 1, -1, -1):
+        cluster = int(np.argmax(np.where(pattern, energy, -np.inf)))
+        pattern.flat[cluster] = False
+        splat(energy, cluster, -1)
+        ranks[cluster] = rank
+
+    # Phase 2: fill the largest voids until the mask is full
+    pattern, energy = initial, initial_energy
+    for rank in range(ones, n):
+        void = int(np.argmin(np.where(pattern, np.inf, energy)))
+        pattern.flat[void] = True
+        splat(energy, void, 1)
+        ranks[void] = rank
+
+    return ranks.reshape(size, size)
+
+
+def threshold_map(matrix):
+    """Scale a rank matrix to uint8-comparable thresholds in (0, 255)."""
+    levels = matrix.size
+    return ((matrix + 0.5) * 255 / levels).astype(np.float32)
+
+
+def ordered_dither(gray, matrix):
+    """Ordered dithering against a tiled threshold matrix.
+
+    Only one matrix-height strip of thresholds is materialized; each of the
+    n row phases is compared in a single vectorized operation.
+    """
+    height, width = gray.shape
+    thresholds = threshold_map(matrix)
+    rows, cols = thresholds.shape
+    strip = np.tile(thresholds, (1, -(-width // cols)))[:, :width]
+
+    out = np.empty((height, width), dtype=bool)
+    for phase in range(min(rows, height)):
+        np.greater(gray[phase::rows], strip[phase], out=out[phase::rows])
+    return out
+
+
+def skew_for(taps):
+    """Smallest skew s such that every tap lands on a later wavefront x + s*y."""
+    skew = 1
+    for dy, dx, _ in taps:
+        if dy > 0:
+            skew = max(skew, -dx // dy + 1)
+    return skew
+
+
+def diffuse_vectorized(gray, taps, band_rows=BAND_ROWS):
+    """Error diffusion vectorized along wavefronts.
+
+    Pixel (y, x) only depends on pixels with a smaller x + s*y, so all pixels
+    on one wavefront can be quantized together. Each band of rows is stored
+    skewed and transposed (row index x + s*y, column index y) so a wavefront is
+    one contiguous slice and every tap is a shifted slice of the next rows.
+    Error that falls below the band is carried into the next one.
+    """
+    height, width = gray.shape
+    skew = skew_for(taps)
+    left = max([0] + [-dx for _, dx, _ in taps])
+    right = max([0] + [dx for _, dx, _ in taps])
+    depth = max([0] + [dy for dy, _, _ in taps])
+
+    out = np.empty((height, width), dtype=bool)
+    carry = np.zeros((depth, width), dtype=np.float32)
+
+    for top in range(0, height, band_rows):
+        rows = min(band_rows, height - top)
+        span = left + width + right + skew * (rows + depth)
+        band = np.zeros((span, rows + depth), dtype=np.float32)
+
+        for y in range(rows):
+            start = left + skew * y
+            band[start:start + width, y] = gray[top + y]
+        for y in range(min(depth, rows)):
+            start = left + skew * y
+            band[start:start + width, y] += carry[y]
+
+        for t in range(left, left + width + skew * (rows - 1)):
+            first = max(0, -((width - 1 - (t - left)) // skew))
+            last = min(rows - 1, (t - left) // skew)
+            if first > last:
+                continue
+            values = band[t, first:last + 1]
+            white = values >= 127.5
+            error = values - 255 * white
+            values[...] = white
+            for dy, dx, weight in taps:
+                band[t + dx + skew * dy, first + dy:last + 1 + dy] += weight * error
+
+        for y in range(rows):
+            start = left + skew * y
+            out[top + y] = band[start:start + width, y] != 0
+
+        carry = np.zeros((depth, width), dtype=np.float32)
+        for k in range(depth):
+            start = left + skew * (rows + k)
+            carry[k] = band[start:start + width, rows + k]
+
+    return out
+
+
+def _diffuse_scanline(gray, taps):
+    height, width = gray.shape
+    values = gray.astype(np.float32)
+    out = np.empty((height, width), dtype=np.bool_)
+    for y in range(height):
+        for x in range(width):
+            value = values[y, x]
+            white = value >= 127.5
+            out[y, x] = white
+            error = value - 255.0 if white else value
+            for k in range(taps.shape[0]):
+                ty = y + int(taps[k, 0])
+                tx = x + int(taps[k, 1])
+                if ty < height and 0 <= tx < width:
+                    values[ty, tx] += taps[k, 2] * error
+    return out
+
+
+_diffuse_numba = njit(cache=True)(_diffuse_scanline) if njit is not None else None
+
+
+def error_diffusion(gray, kernel, use_numba=None):
+    """Dither with a named error diffusion kernel.
+
+    Uses the Numba-compiled scanline loop when Numba is installed (or when
+    use_numba is True), and the wavefront-vectorized NumPy path otherwise.
+    """
+    taps = DIFFUSION_KERNELS[kernel]
+    if use_numba is None:
+        use_numba = _diffuse_numba is not None
+    if use_numba:
+        if _diffuse_numba is None:
+            raise RuntimeError("Numba is not installed")
+        return _diffuse_numba(np.ascontiguousarray(gray), np.array(taps, dtype=np.float64))
+    return diffuse_vectorized(gray, taps)
+
+
+def dither(gray, algorithm="pil", use_numba=None):
+    """Dither an 'L' image or 2-D uint8 array to a bool array (True = white)."""
+    if algorithm == "pil":
+        if not isinstance(gray, Image.Image):
+            gray = Image.fromarray(gray)
+        # PIL stores mode '1' as 0/255 bytes; normalize to a real bool array
+        return np.asarray(gray.convert('1')).view(np.uint8) != 0
+
+    gray = np.asarray(gray)
+    if algorithm in DIFFUSION_KERNELS:
+        return error_diffusion(gray, algorithm, use_numba=use_numba)
+    if algorithm == "bayer":
+        return ordered_dither(gray, bayer_matrix(8))
+    if algorithm == "blue-noise":
+        return ordered_dither(gray, blue_noise_matrix())
+    raise ValueError(f"Unknown dithering algorithm: {algorithm}")
+
+
+def nearest_indices(src_length, length):
+    """Source index for each output index under PIL's Image.NEAREST mapping.
+
+    PIL maps coordinates in fixed point, so the indices are taken from PIL
+    itself by resizing a one-row index image rather than recomputed here.
+    """
+    ramp = Image.fromarray(np.arange(src_length, dtype=np.int32)[None, :])
+    return np.asarray(ramp.resize((length, 1), Image.NEAREST))[0].astype(np.intp)
+
+
+def resize_bits(bits, size):
+    """Nearest-neighbour resize of a 2-D bool array to size (width, height).
+
+    Matches PIL's Image.NEAREST pixel for pixel.
+    """
+    width, height = size
+    src_height, src_width = bits.shape
+    if (src_width, src_height) == (width, height):
+        return bits
+    rows = nearest_indices(src_height, height)
+    cols = nearest_indices(src_width, width)
+    return bits[rows[:, None], cols[None, :]]
+
+
+def bits_to_transparent(bits, invert=False, mode="RGBA"):
+    """Turn a dithered bool array (True = white) into a transparent image.
+
+    White pixels become transparent, or black ones if invert is set. RGBA and
+    LA are built with a single lookup-table gather over the bit array; P keeps
+    the bits as palette indices with a two-colour palette.
+    """
+    if invert:
+        black, white = (0, 0, 0, 0), (255, 255, 255, 255)
+    else:
+        black, white = (0, 0, 0, 255), (255, 255, 255, 0)
+
+    height, width = bits.shape
+    indices = np.ascontiguousarray(bits).view(np.uint8)
+
+    if mode == "RGBA":
+        lut = np.array([black, white], dtype=np.uint8)
+        return Image.fromarray(lut[indices])
+    if mode == "LA":
+        lut = np.array([[black[0], black[3]], [white[0], white[3]]], dtype=np.uint8)
+        return Image.frombuffer("LA", (width, height), lut[indices], "raw", "LA", 0, 1)
+    if mode == "P":
+        image = Image.frombuffer("P", (width, height), indices, "raw", "P", 0, 1)
+        image.putpalette([0, 0, 0, 255, 255, 255])
+        image.info["transparency"] = 0 if invert else 1
+        return image
+    raise ValueError(f"Unsupported output mode: {mode}")
+
+
+BENCHMARK_SIZES = {
+    "4k": (3840, 2160),
+    "8k": (7680, 4320),
+    "16k": (15360, 8640),
+}
+
+
+def benchmark_input(size, seed=0):
+    """Horizontal gradient plus noise, so every kernel has real work to do."""
+    width, height = size
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    noise = rng.normal(0, 24, (height, width)).astype(np.float32)
+    return np.clip(gradient + noise, 0, 255).astype(np.uint8)
+
+
+def benchmark(sizes=("4k", "8k", "16k"), algorithms=ALGORITHMS, repeats=1):
+    """Print megapixels/s for each algorithm at each size."""
+    variants = []
+    for algorithm in algorithms:
+        if algorithm in DIFFUSION_KERNELS:
+            variants.append((algorithm + " (numpy)", algorithm, False))
+            if _diffuse_numba is not None:
+                variants.append((algorithm + " (numba)", algorithm, True))
+        else:
+            variants.append((algorithm, algorithm, None))
+
+    # Warm up lazily built state (blue-noise mask, Numba compilation)
+    warmup = benchmark_input((64, 64))
+    for _, algorithm, use_numba in variants:
+        dither(warmup, algorithm, use_numba=use_numba)
+
+    print(f"{'algorithm':<26}" + "".join(f"{name:>12}" for name in sizes))
+    for label, algorithm, use_numba in variants:
+        row = f"{label:<26}"
+        for name in sizes:
+            size = BENCHMARK_SIZES[name]
+            gray = benchmark_input(size)
+            best = float("inf")
+            for _ in range(repeats):
+                start = time.perf_counter()
+                dither(gray, algorithm, use_numba=use_numba)
+                best = min(best, time.perf_counter() - start)
+            megapixels = size[0] * size[1] / 1e6
+            row += f"{megapixels / best:>8.1f} MP/s"
+        print(row, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dithering kernels")
+    parser.add_argument("--sizes", nargs="+", choices=list(BENCHMARK_SIZES), default=["4k", "8k", "16k"],
+                        help="Input sizes to benchmark (default: 4k 8k 16k)")
+    parser.add_argument("--algorithms", nargs="+", choices=ALGORITHMS, default=list(ALGORITHMS),
+                        help="Algorithms to benchmark (default: all)")
+    parser.add_argument("--repeats", type=int, default=1, help="Runs per measurement, best is kept (default: 1)")
+
+    args = parser.parse_args()
+
+    benchmark(args.sizes, args.algorithms, args.repeats)
+
+if __name__ == "__main__":
+    main()
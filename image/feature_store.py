@@ -0,0 +1,262 @@
+"""On-disk store of ORB descriptors and perceptual hashes for an image folder.
+
+Two files sit side by side:
+
+    <base>.<generation>.npy  every image's ORB descriptors stacked into one
+                             (total, 32) uint8 array, opened memory-mapped
+    <base>.json              the generation of the array it describes, and
+                             per image: mtime_ns and size when extracted,
+                             offset and row count in the array, and the
+                             64-bit perceptual hash
+
+Each rewrite packs a new array under a fresh generation and then replaces
+the index, so the index rename is the single commit point: a run that dies
+before it leaves the old index pointing at the old, intact array. Arrays of
+earlier generations, and the files of older layouts (<base>.npy and the
+pickled <base>.pkl), are deleted once a new store has been committed.
+Unfinished .part arrays are never touched, since another run may still be
+writing one.
+
+An image is only re-extracted when its mtime or size changes, so rerunning
+on an unchanged folder reads the index and maps the array without touching
+the images. Extraction runs on a process pool; new descriptors are streamed
+to a scratch file as they arrive, then the array is rewritten once.
+"""
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from image_index import perceptual_hash_gray
+
+# Bytes per ORB descriptor
+DESCRIPTOR_BYTES = 32
+
+GENERATION_PATTERN = re.compile(r"[0-9a-f]{16}")
+
+
+def extract_features(image_path):
+    """Return (ORB descriptors or None, perceptual hash) from a single read of the image."""
+    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        raise ValueError("could not read image")
+    _, des = cv2.ORB_create().detectAndCompute(img, None)
+    return des, perceptual_hash_gray(img)
+
+
+def extract_features_safe(image_path):
+    """Return (image_path, descriptors, hash, error message or None) instead of raising."""
+    try:
+        des, phash = extract_features(image_path)
+        return image_path, des, phash, None
+    except Exception as e:
+        return image_path, None, None, str(e)
+
+
+def extracted(image_paths, workers=1):
+    """Yield extract_features_safe results in order, on a process pool when workers > 1."""
+    if workers <= 1 or len(image_paths) < 2:
+        yield from map(extract_features_safe, image_paths)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(extract_features_safe, image_paths, chunksize=16)
+
+
+def file_key(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def open_descriptors(path):
+    array = np.load(path, mmap_mode="r")
+    if array.shape[0] == 0:
+        return np.zeros((0, DESCRIPTOR_BYTES), dtype=np.uint8)
+    return array
+
+
+class FeatureStore:
+    """Mapping of image path -> ORB descriptors (a read-only view, or None).
+
+    After update(image_paths), iterating the store yields those images in
+    order (minus any that failed to load). Entries for other images that
+    still exist on disk are kept for later runs.
+    """
+
+    def __init__(self, base_path):
+        self.base_path = base_path
+        self.index_path = base_path + ".json"
+        self.generation = None
+        self.entries = {}
+        self.images = []
+        self.descriptors = np.zeros((0, DESCRIPTOR_BYTES), dtype=np.uint8)
+        if not os.path.exists(self.index_path):
+            return  # no store yet
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+            generation = index["generation"]
+            descriptors = open_descriptors(self.array_path(generation))
+            entries = index["images"]
+            # Every entry must lie inside the array it was written against; if
+            # not, start over rather than slice another image's descriptors
+            rows = len(descriptors)
+            if index["rows"] != rows or any(entry["offset"] < 0 or entry["count"] < 0
+                                            or entry["offset"] + entry["count"] > rows
+                                            for entry in entries.values()):
+                raise ValueError("index does not match its array")
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            # Unreadable, malformed or from an older layout: extract everything again
+            print(f"Feature cache {self.index_path} cannot be used ({e!r}); rebuilding")
+            return
+        self.generation = generation
+        self.entries = entries
+        self.descriptors = descriptors
+
+    def array_path(self, generation):
+        return f"{self.base_path}.{generation}.npy"
+
+    def __getitem__(self, image_path):
+        entry = self.entries[image_path]
+        if entry["count"] == 0:
+            return None
+        return self.descriptors[entry["offset"]:entry["offset"] + entry["count"]]
+
+    def __contains__(self, image_path):
+        return image_path in self.entries
+
+    def __iter__(self):
+        return iter(self.images)
+
+    def __len__(self):
+        return len(self.images)
+
+    def keys(self):
+        return list(self.images)
+
+    def hash(self, image_path):
+        return self.entries[image_path]["hash"]
+
+    def update(self, image_paths, workers=1):
+        """Extract features for new or changed images and save the store if anything changed.
+
+        Returns the number of images extracted.
+        """
+        keys = {}
+        stale = []
+        for image_path in image_paths:
+            try:
+                keys[image_path] = file_key(image_path)
+            except OSError:
+                continue
+            entry = self.entries.get(image_path)
+            if entry is None or (entry["mtime_ns"], entry["size"]) != keys[image_path]:
+                stale.append(image_path)
+
+        vanished = [image_path for image_path in self.entries
+                    if image_path not in keys and not os.path.exists(image_path)]
+
+        if stale or vanished:
+            self._rewrite(stale, vanished, keys, workers)
+
+        self.images = [image_path for image_path in image_paths if image_path in self.entries]
+        return len(stale)
+
+    def _rewrite(self, stale, vanished, keys, workers):
+        scratch_path = self.index_path + f".{os.getpid()}.new"
+        new_entries = {}
+        failed = 0
+        try:
+            with open(scratch_path, "wb") as scratch:
+                offset = 0
+                for image_path, des, phash, error in tqdm(extracted(stale, workers), total=len(stale),
+                                                          desc="Extracting features"):
+                    if error:
+                        print(f"Skipping {image_path}: {error}")
+                        failed += 1
+                        continue
+                    count = 0 if des is None else len(des)
+                    if count:
+                        scratch.write(np.ascontiguousarray(des, dtype=np.uint8).tobytes())
+                    mtime_ns, size = keys[image_path]
+                    new_entries[image_path] = {"mtime_ns": mtime_ns, "size": size, "offset": offset,
+                                               "count": count, "hash": phash}
+                    offset += count
+
+            dropped = set(stale) | set(vanished)
+            kept = {image_path: entry for image_path, entry in self.entries.items() if image_path not in dropped}
+            self._write(kept, new_entries, scratch_path)
+        finally:
+            if os.path.exists(scratch_path):
+                os.remove(scratch_path)
+
+        if failed:
+            print(f"{failed} images could not be read")
+
+    def _write(self, kept, new_entries, scratch_path):
+        """Pack kept and new descriptors into a new generation's array, then commit it by replacing the index."""
+        kept_total = sum(entry["count"] for entry in kept.values())
+        new_total = sum(entry["count"] for entry in new_entries.values())
+
+        generation = os.urandom(8).hex()
+        temp_array = self.array_path(generation) + ".part"
+        packed = np.lib.format.open_memmap(temp_array, mode="w+", dtype=np.uint8,
+                                           shape=(kept_total + new_total, DESCRIPTOR_BYTES))
+        entries = {}
+        offset = 0
+        for image_path, entry in kept.items():
+            count = entry["count"]
+            packed[offset:offset + count] = self.descriptors[entry["offset"]:entry["offset"] + count]
+            entries[image_path] = dict(entry, offset=offset)
+            offset += count
+
+        if new_total:
+            scratch = np.memmap(scratch_path, dtype=np.uint8, mode="r", shape=(new_total, DESCRIPTOR_BYTES))
+            packed[offset:] = scratch
+            del scratch
+        for image_path, entry in new_entries.items():
+            entries[image_path] = dict(entry, offset=offset + entry["offset"])
+
+        packed.flush()
+        del packed
+        os.replace(temp_array, self.array_path(generation))
+
+        temp_index = self.index_path + f".{os.getpid()}.part"
+        with open(temp_index, "w") as f:
+            json.dump({"descriptor_bytes": DESCRIPTOR_BYTES, "generation": generation,
+                       "rows": kept_total + new_total, "images": entries}, f)
+        os.replace(temp_index, self.index_path)
+
+        self.generation = generation
+        self.entries = entries
+        self.descriptors = open_descriptors(self.array_path(generation))
+        self._remove_old_files()
+
+    def _remove_old_files(self):
+        """Delete committed arrays of earlier generations and the files of older layouts.
+
+        The generation the index names now is kept as well as our own, in case
+        another run committed after us. .part files are left alone.
+        """
+        keep = {self.generation}
+        try:
+            with open(self.index_path) as f:
+                keep.add(json.load(f).get("generation"))
+        except (OSError, ValueError, AttributeError):
+            pass
+        directory, prefix = os.path.split(self.base_path)
+        for name in os.listdir(directory or "."):
+            if not name.startswith(prefix + "."):
+                continue
+            suffix = name[len(prefix) + 1:]
+            generation = suffix[:-len(".npy")] if suffix.endswith(".npy") else None
+            stale = suffix in ("npy", "pkl") or (generation is not None and GENERATION_PATTERN.fullmatch(generation)
+                                                 and generation not in keep)
+            if stale:
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
@@ -0,0 +1,175 @@
+"""Perceptual hashes and a Hamming-space nearest-neighbour index.
+
+Used by sortImages_iterative to find likely neighbours of an image without
+matching ORB descriptors against every other image: a 64-bit DCT perceptual
+hash gives a coarse distance, a vantage-point tree over the hashes answers
+k-nearest queries in roughly O(log n), and only those k candidates are
+re-ranked with exact ORB matching.
+"""
+import cv2
+import numpy as np
+
+# Byte popcount table, used when NumPy has no bitwise_count (NumPy < 2.0)
+POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount(values):
+    """Number of set bits in each element of an unsigned integer array."""
+    values = np.asarray(values)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    as_bytes = np.ascontiguousarray(values).reshape(values.shape + (1,)).view(np.uint8)
+    return POPCOUNT8[as_bytes].sum(axis=-1, dtype=np.uint16)
+
+
+def hamming64(hashes, query):
+    """Hamming distances between an array of uint64 hashes and one hash."""
+    return popcount(np.bitwise_xor(hashes, np.uint64(query))).astype(np.int64)
+
+
+def perceptual_hash_gray(img):
+    """pHash of a grayscale array.
+
+    The image is shrunk to 32x32; each bit says whether one of the 64
+    lowest-frequency DCT coefficients is above their median.
+    """
+    small = cv2.resize(img, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].ravel()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+class HammingVPTree:
+    """Vantage-point tree over 64-bit hashes with item removal.
+
+    Nodes live in flat arrays. Every node keeps a count of the live items in
+    its subtree, so once a region has been fully consumed (e.g. by a greedy
+    walk that removes each image it visits) queries skip it entirely.
+    """
+
+    def __init__(self, hashes, leaf_size=256, seed=0):
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        self.leaf_size = leaf_size
+        self.alive = np.ones(len(self.hashes), dtype=bool)
+        self.owner = np.zeros(len(self.hashes), dtype=np.int64)
+
+        self.vantage = []    # item index, or -1 for a leaf
+        self.radius = []     # items with distance <= radius go inside
+        self.inside = []
+        self.outside = []
+        self.leaf_items = []
+        self.parent = []
+        self.count = []
+
+        rng = np.random.default_rng(seed)
+        if len(self.hashes):
+            self._build(np.arange(len(self.hashes)), -1, rng)
+
+    def _new_node(self, parent, size):
+        self.vantage.append(-1)
+        self.radius.append(0)
+        self.inside.append(-1)
+        self.outside.append(-1)
+        self.leaf_items.append(None)
+        self.parent.append(parent)
+        self.count.append(size)
+        return len(self.vantage) - 1
+
+    def _build(self, items, parent, rng):
+        # Iterative build; each stack entry is (items, parent node, which child slot)
+        stack = [(items, parent, None)]
+        while stack:
+            items, parent, slot = stack.pop()
+            node = self._new_node(parent, len(items))
+            if slot is not None:
+                getattr(self, slot)[parent] = node
+
+            if len(items) <= self.leaf_size:
+                self._make_leaf(node, items)
+                continue
+
+            pick = rng.integers(len(items))
+            vantage = items[pick]
+            rest = np.delete(items, pick)
+            distances = hamming64(self.hashes[rest], self.hashes[vantage])
+            radius = int(np.median(distances))
+            inner = distances <= radius
+            if inner.all() or not inner.any():
+                # All remaining points are equidistant (e.g. duplicate
+                # frames); no split is possible, so keep them as one bucket
+                self._make_leaf(node, items)
+                continue
+
+            self.vantage[node] = vantage
+            self.radius[node] = radius
+            self.owner[vantage] = node
+            stack.append((rest[inner], node, "inside"))
+            stack.append((rest[~inner], node, "outside"))
+
+    def _make_leaf(self, node, items):
+        self.leaf_items[node] = items
+        self.owner[items] = node
+
+    def remove(self, item):
+        """Mark an item as consumed so queries no longer return it."""
+        if not self.alive[item]:
+            return
+        self.alive[item] = False
+        node = self.owner[item]
+        while node != -1:
+            self.count[node] -= 1
+            node = self.parent[node]
+
+    def __len__(self):
+        return self.count[0] if self.count else 0
+
+    def nearest(self, query, k=10):
+        """Return up to k (distance, item) pairs of live items closest to query."""
+        if not self.count or self.count[0] == 0:
+            return []
+        query = np.uint64(query)
+        best = []  # sorted list of (distance, item)
+        tau = float("inf")
+
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if node == -1 or self.count[node] == 0:
+                continue
+
+            items = self.leaf_items[node]
+            if items is not None:
+                items = items[self.alive[items]]
+                if len(items):
+                    distances = hamming64(self.hashes[items], query)
+                    if len(best) == k:
+                        closer = distances < tau
+                        items, distances = items[closer], distances[closer]
+                    best.extend(zip(distances.tolist(), items.tolist()))
+                    best.sort()
+                    del best[k:]
+                    if len(best) == k:
+                        tau = best[-1][0]
+                continue
+
+            vantage = self.vantage[node]
+            distance = bin(int(query) ^ int(self.hashes[vantage])).count("1")
+            if self.alive[vantage] and (distance < tau or len(best) < k):
+                best.append((distance, vantage))
+                best.sort()
+                del best[k:]
+                if len(best) == k:
+                    tau = best[-1][0]
+
+            radius = self.radius[node]
+            # Visit the side the query falls in last so it is popped first
+            if distance <= radius:
+                if distance + tau > radius:
+                    stack.append(self.outside[node])
+                stack.append(self.inside[node])
+            else:
+                if distance - tau <= radius:
+                    stack.append(self.inside[node])
+                stack.append(self.outside[node])
+
+        return best
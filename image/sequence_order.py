@@ -0,0 +1,260 @@
+"""Order images into a smooth sequence over a sparse k-NN graph.
+
+Instead of sorting everything by similarity to one seed, every image gets its
+k most similar neighbours once (perceptual-hash candidates from image_index,
+weighted by an exact re-rank such as ORB matching). A path is then built by
+greedy nearest-neighbour chaining and refined with 2-opt and Or-opt moves
+until no move helps or the time budget runs out. Moves are only tried
+against an image's graph neighbours, so each pass costs O(n k).
+
+Edge weights from the re-rank are expected in [0, 1]. Pairs that are not in
+the graph get 1 + (hash distance / 64), which is always worse than any graph
+edge but still tells near misses from strangers.
+"""
+import time
+
+import numpy as np
+from tqdm import tqdm
+
+from image_index import HammingVPTree, popcount
+
+# Improvements smaller than this are treated as float noise
+EPSILON = 1e-9
+
+
+class KnnGraph:
+    """k nearest neighbours per node, as padded (n, k) arrays.
+
+    neighbors[i] lists node indices sorted by weight, padded with -1;
+    weights[i] holds the matching weights, padded with inf.
+    """
+
+    def __init__(self, hashes, neighbors, weights):
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        self.neighbors = neighbors
+        self.weights = weights
+
+    def __len__(self):
+        return len(self.neighbors)
+
+    def distances(self, a, b):
+        """Vectorized distance between node arrays a and b.
+
+        Index -1 stands for the open end of the path and is at distance 0
+        from everything.
+        """
+        a = np.asarray(a)
+        b = np.asarray(b)
+        ends = (a < 0) | (b < 0)
+        a = np.where(a < 0, 0, a)
+        b = np.where(b < 0, 0, b)
+
+        forward = np.where(self.neighbors[a] == b[..., None], self.weights[a], np.inf).min(axis=-1)
+        backward = np.where(self.neighbors[b] == a[..., None], self.weights[b], np.inf).min(axis=-1)
+        weight = np.minimum(forward, backward)
+
+        fallback = 1.0 + popcount(self.hashes[a] ^ self.hashes[b]) / 64.0
+        weight = np.where(np.isfinite(weight), weight, fallback)
+        return np.where(ends, 0.0, weight)
+
+
+def build_knn_graph(hashes, k, rerank, desc="k-NN graph"):
+    """Build a KnnGraph from perceptual hashes.
+
+    For each node the k nearest hashes are looked up in a vantage-point tree
+    and passed to rerank(node, candidates), which returns one weight per
+    candidate (lower is more similar).
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    n = len(hashes)
+    k = max(1, min(k, n - 1))
+    tree = HammingVPTree(hashes)
+    neighbors = np.full((n, k), -1, dtype=np.int64)
+    weights = np.full((n, k), np.inf)
+
+    for node in tqdm(range(n), desc=desc):
+        candidates = [item for _, item in tree.nearest(hashes[node], k + 1) if item != node][:k]
+        if not candidates:
+            continue
+        candidates = np.array(candidates, dtype=np.int64)
+        scores = np.asarray(rerank(node, candidates), dtype=np.float64)
+        order = np.argsort(scores, kind="stable")
+        neighbors[node, :len(order)] = candidates[order]
+        weights[node, :len(order)] = scores[order]
+
+    return KnnGraph(hashes, neighbors, weights)
+
+
+def greedy_path(graph, start=0):
+    """Chain nodes by always stepping to the closest unvisited graph neighbour.
+
+    When every neighbour has been visited the walk jumps to the closest
+    unvisited node by hash, found in a tree that drops nodes as they are used.
+    """
+    n = len(graph)
+    visited = np.zeros(n, dtype=bool)
+    tree = HammingVPTree(graph.hashes)
+    path = [start]
+    visited[start] = True
+    tree.remove(start)
+    current = start
+    jumps = 0
+
+    for _ in range(n - 1):
+        row = graph.neighbors[current]
+        row = row[row >= 0]
+        free = row[~visited[row]]
+        if len(free):
+            current = int(free[0])
+        else:
+            current = tree.nearest(graph.hashes[current], 1)[0][1]
+            jumps += 1
+        path.append(current)
+        visited[current] = True
+        tree.remove(current)
+
+    return np.array(path, dtype=np.int64), jumps
+
+
+def path_cost(graph, path):
+    return float(graph.distances(path[:-1], path[1:]).sum())
+
+
+def _neighbours_at(path, positions):
+    """Node at each position, or -1 past either end of the path."""
+    inside = (positions >= 0) & (positions < len(path))
+    return np.where(inside, path[np.clip(positions, 0, len(path) - 1)], -1)
+
+
+def two_opt_pass(graph, path, pos, deadline):
+    """One sweep of neighbour-list 2-opt. Returns the number of moves applied.
+
+    path[0] is never moved.
+    """
+    n = len(path)
+    moves = 0
+    for i in range(n):
+        if time.perf_counter() > deadline:
+            break
+        a = path[i]
+        c = graph.neighbors[a]
+        c = c[c >= 0]
+        if not len(c):
+            continue
+        j = pos[c]
+
+        # Forward: a b ... c d  ->  a c ... b d  (reverse i+1..j)
+        b = _neighbours_at(path, np.array([i + 1]))[0]
+        forward = j > i + 1
+        d = _neighbours_at(path, j + 1)
+        gain_forward = (graph.distances([a], [b])[0] + graph.distances(c, d)
+                        - graph.distances(np.full_like(c, a), c) - graph.distances(np.full_like(c, b), d))
+        gain_forward = np.where(forward & (b >= 0), gain_forward, -np.inf)
+
+        # Backward: e c ... p a  ->  e p ... c a  (reverse j..i-1)
+        p = _neighbours_at(path, np.array([i - 1]))[0]
+        backward = (j < i - 1) & (j >= 1)
+        e = _neighbours_at(path, j - 1)
+        gain_backward = (graph.distances([p], [a])[0] + graph.distances(e, c)
+                         - graph.distances(c, np.full_like(c, a)) - graph.distances(e, np.full_like(c, p)))
+        gain_backward = np.where(backward & (p >= 0), gain_backward, -np.inf)
+
+        best_forward = int(np.argmax(gain_forward))
+        best_backward = int(np.argmax(gain_backward))
+        if max(gain_forward[best_forward], gain_backward[best_backward]) <= EPSILON:
+            continue
+        if gain_forward[best_forward] >= gain_backward[best_backward]:
+            start, stop = i + 1, j[best_forward]
+        else:
+            start, stop = j[best_backward], i - 1
+        path[start:stop + 1] = path[start:stop + 1][::-1]
+        pos[path[start:stop + 1]] = np.arange(start, stop + 1)
+        moves += 1
+    return moves
+
+
+def or_opt_pass(graph, path, pos, deadline, max_segment=3):
+    """One sweep of Or-opt: move runs of up to max_segment nodes next to a graph neighbour.
+
+    path[0] is never moved.
+    """
+    moves = 0
+    i = 1
+    while i < len(path):
+        if time.perf_counter() > deadline:
+            break
+        moved = False
+        for length in range(1, max_segment + 1):
+            if i + length > len(path):
+                break
+            first, last = path[i], path[i + length - 1]
+            prev, after = _neighbours_at(path, np.array([i - 1, i + length]))
+            removal = (graph.distances([prev, last], [first, after]).sum()
+                       - graph.distances([prev], [after])[0])
+
+            # Insert after a neighbour c of the first node: c first..last succ(c)
+            c = graph.neighbors[first]
+            c = c[c >= 0]
+            jc = pos[c]
+            succ = _neighbours_at(path, jc + 1)
+            after_cost = (graph.distances(c, np.full_like(c, first)) + graph.distances(np.full_like(c, last), succ)
+                          - graph.distances(c, succ))
+            after_ok = (jc < i - 1) | (jc >= i + length)
+
+            # Insert before a neighbour c of the last node: pred(c) first..last c
+            q = graph.neighbors[last]
+            q = q[q >= 0]
+            jq = pos[q]
+            pred = _neighbours_at(path, jq - 1)
+            before_cost = (graph.distances(pred, np.full_like(q, first)) + graph.distances(np.full_like(q, last), q)
+                           - graph.distances(pred, q))
+            before_ok = ((jq < i) | (jq > i + length)) & (jq >= 1)
+
+            gain_after = np.where(after_ok, removal - after_cost, -np.inf)
+            gain_before = np.where(before_ok, removal - before_cost, -np.inf)
+            best_after = int(np.argmax(gain_after)) if len(c) else -1
+            best_before = int(np.argmax(gain_before)) if len(q) else -1
+            best_gain_after = gain_after[best_after] if best_after >= 0 else -np.inf
+            best_gain_before = gain_before[best_before] if best_before >= 0 else -np.inf
+            if max(best_gain_after, best_gain_before) <= EPSILON:
+                continue
+
+            segment = path[i:i + length].copy()
+            rest = np.delete(path, np.arange(i, i + length))
+            if best_gain_after >= best_gain_before:
+                anchor = c[best_after]
+                target = int(np.flatnonzero(rest == anchor)[0]) + 1
+            else:
+                anchor = q[best_before]
+                target = int(np.flatnonzero(rest == anchor)[0])
+            path[:] = np.insert(rest, target, segment)
+            pos[path] = np.arange(len(path))
+            moves += 1
+            moved = True
+            break
+        if not moved:
+            i += 1
+    return moves
+
+
+def order_sequence(graph, start=0, time_budget=10.0):
+    """Greedy path from start, refined with 2-opt and Or-opt for up to time_budget seconds.
+
+    The start node stays first in the returned path.
+    """
+    path, jumps = greedy_path(graph, start)
+    print(f"Greedy path cost {path_cost(graph, path):.3f} ({jumps} jumps outside the graph)")
+
+    deadline = time.perf_counter() + time_budget
+    pos = np.empty(len(path), dtype=np.int64)
+    pos[path] = np.arange(len(path))
+    passes = 0
+    while len(path) > 3 and time.perf_counter() < deadline:
+        moves = two_opt_pass(graph, path, pos, deadline)
+        moves += or_opt_pass(graph, path, pos, deadline)
+        passes += 1
+        if not moves:
+            break
+
+    print(f"Refined path cost {path_cost(graph, path):.3f} after {passes} passes")
+    return path
@@ -1,50 +1,180 @@
 import os
-import cv2
-import pickle
+import errno
+import numpy as np
 import shutil
+from collections import Counter
 from tqdm import tqdm
 import argparse
 
-def copy_and_rename(image_path, idx, output_folder):
-    """Copy the image to the output folder and rename it based on the index."""
-    new_name = os.path.join(output_folder, f"frame_{idx}.png")
-    shutil.copy(image_path, new_name)
+from feature_store import FeatureStore
+from sequence_order import build_knn_graph, order_sequence
 
-def extract_features(image_path):
-    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-    orb = cv2.ORB_create()
-    _, des = orb.detectAndCompute(img, None)
-    return des
+SORT_METHODS = ("index", "window")
 
-def compute_similarity(des1, des2, seed_index, current_index, index_penalty=0.5, distance_threshold=30):
-    if des1 is None or des2 is None or len(des1) == 0 or len(des2) == 0:
-        return float('inf')
+# copy/hardlink/symlink/reflink/auto place files; manifest/concat only list them
+OUTPUT_MODES = ("copy", "hardlink", "symlink", "reflink", "auto", "manifest", "concat")
 
-    bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-    matches = bf.match(des1, des2)
-    
-    # Filter matches based on the threshold
-    good_matches = [m for m in matches if m.distance < distance_threshold]
-    
-    # If there are no good matches, return a large distance
-    if not good_matches:
-        return float('inf')
-    
-    # Using the sum of distances of good matches as the score
-    similarity = sum([m.distance for m in good_matches])
-    
-    # Adjusting similarity using index difference
-    index_diff = abs(seed_index - current_index)
-    similarity += index_penalty * index_diff
+# Linux ioctl that clones a file's extents (btrfs, XFS, bcachefs, ...)
+FICLONE = 0x40049409
+
+# Upper bound on float32 cells (distance matrix plus unpacked candidate bits) per batch chunk
+BATCH_CELLS = 8_000_000
+
+def frame_name(idx, count):
+    """frame_<idx>.png, zero-padded so the names sort in sequence order."""
+    return f"frame_{idx:0{len(str(max(count - 1, 0)))}d}.png"
+
+def reflink(source, destination):
+    """Clone source into destination without copying data, or raise OSError."""
+    import fcntl
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(destination)
+            raise
+
+def place_file(source, destination, mode):
+    """Put source at destination as a copy, hardlink, symlink or reflink.
+
+    Links that the filesystem refuses (other device, no reflink support,
+    no symlink permission) fall back to a copy. auto tries a reflink, then
+    a hardlink. Note that hardlinked frames share data with the originals.
+    Returns the method actually used.
+    """
+    if os.path.lexists(destination):
+        os.remove(destination)
 
-    return similarity
+    attempts = {"copy": [], "hardlink": ["hardlink"], "symlink": ["symlink"], "reflink": ["reflink"],
+                "auto": ["reflink", "hardlink"]}[mode]
+    for method in attempts:
+        try:
+            if method == "hardlink":
+                os.link(source, destination)
+            elif method == "symlink":
+                os.symlink(os.path.abspath(source), destination)
+            else:
+                reflink(source, destination)
+            return method
+        except (OSError, ImportError) as e:
+            if isinstance(e, OSError) and e.errno not in (errno.EXDEV, errno.EPERM, errno.EACCES, errno.EOPNOTSUPP,
+                                                          errno.ENOTTY, errno.EINVAL, errno.EMLINK, errno.ENOSYS):
+                raise
+    shutil.copy(source, destination)
+    return "copy"
 
-def cache_features(image_folder, cache_path, num_images=None):
-    if os.path.exists(cache_path):
-        with open(cache_path, 'rb') as f:
-            features_cache = pickle.load(f)
+def write_manifest(image_paths, output_folder, mode, frame_rate=24):
+    """Write the order as a list of absolute paths, or as an ffmpeg concat script.
+
+    The concat script can be fed straight to an encoder:
+        ffmpeg -f concat -safe 0 -i order.ffconcat ...
+    """
+    if mode == "concat":
+        path = os.path.join(output_folder, "order.ffconcat")
+        with open(path, "w") as f:
+            f.write("ffconcat version 1.0\n")
+            for image_path in image_paths:
+                escaped = os.path.abspath(image_path).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\nduration {1 / frame_rate:.6f}\n")
     else:
-        features_cache = {}
+        path = os.path.join(output_folder, "order.txt")
+        with open(path, "w") as f:
+            for image_path in image_paths:
+                f.write(os.path.abspath(image_path) + "\n")
+    return path
+
+def write_output(image_paths, output_folder, mode="copy", frame_rate=24):
+    if mode in ("manifest", "concat"):
+        path = write_manifest(image_paths, output_folder, mode, frame_rate)
+        print(f"Wrote {len(image_paths)} entries to {path}")
+        return
+
+    methods = Counter()
+    for idx, image_path in enumerate(tqdm(image_paths, desc="Writing frames")):
+        destination = os.path.join(output_folder, frame_name(idx, len(image_paths)))
+        methods[place_file(image_path, destination, mode)] += 1
+    print("Wrote " + ", ".join(f"{count} by {method}" for method, count in methods.items()))
+
+def cross_check_batch(seed_des, candidates):
+    """Cross-checked matches between one descriptor set and many, all at once.
+
+    Gives the same matches as cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+    between seed_des and every candidate. Descriptors are unpacked to 0/1 rows so that Hamming distance
+    is |a| + |b| - 2 a.b, one float32 matrix product for a whole chunk of
+    candidates. Candidates are padded to a common length (ORB caps the
+    keypoints per image, so this wastes little) and nearest neighbours in
+    each direction come from argmin, which takes the first index on ties
+    just like OpenCV.
+
+    Returns (candidate number, distance) arrays with one entry per match.
+    """
+    lengths = np.array([0 if des is None else len(des) for des in candidates], dtype=np.int64)
+    present = np.flatnonzero(lengths)
+    if seed_des is None or len(seed_des) == 0 or len(present) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+    seed_bits = np.unpackbits(np.asarray(seed_des), axis=1).astype(np.float32)
+    seed_norms = seed_bits.sum(axis=1)
+    rows, width = len(seed_bits), seed_des.shape[1]
+    longest = int(lengths.max())
+    per_chunk = max(1, BATCH_CELLS // ((rows + 8 * width) * longest))
+
+    owners, distances = [], []
+    for start in range(0, len(present), per_chunk):
+        chunk = present[start:start + per_chunk]
+        valid = np.arange(longest)[None, :] < lengths[chunk][:, None]
+        padded = np.zeros((len(chunk) * longest, width), dtype=np.uint8)
+        padded[valid.ravel()] = np.concatenate([np.asarray(candidates[i]) for i in chunk])
+        bits = np.unpackbits(padded, axis=1).astype(np.float32)
+
+        distance = seed_norms[:, None] + bits.sum(axis=1)[None, :] - 2 * (seed_bits @ bits.T)
+        distance = distance.reshape(rows, len(chunk), longest)
+        distance[:, ~valid] = np.inf
+
+        backward = distance.argmin(axis=0)   # best seed row per candidate row
+        forward = distance.argmin(axis=2)    # best candidate row per seed row
+        mutual = backward[np.arange(len(chunk))[None, :], forward] == np.arange(rows)[:, None]
+        seed_rows, slots = np.nonzero(mutual)
+        owners.append(chunk[slots])
+        distances.append(distance[seed_rows, slots, forward[seed_rows, slots]])
+
+    return np.concatenate(owners), np.concatenate(distances)
+
+def compute_similarity_batch(seed_des, candidates, seed_index, candidate_indices, index_penalty=0.5,
+                             distance_threshold=30):
+    """Similarity score of one seed against every candidate, as a float array (lower is closer).
+
+    The score is the summed distance of the good cross-checked matches plus
+    index_penalty per position between the two images; candidates with no
+    good match (or no descriptors) score inf.
+    """
+    owners, distances = cross_check_batch(seed_des, candidates)
+    good = distances < distance_threshold
+    count = np.bincount(owners[good], minlength=len(candidates))
+    total = np.bincount(owners[good], weights=distances[good], minlength=len(candidates))
+    penalty = index_penalty * np.abs(seed_index - np.asarray(candidate_indices))
+    return np.where(count > 0, total + penalty, np.inf)
+
+def match_distance_batch(seed_des, candidates, distance_threshold=30):
+    """ORB distance in [0, 1] for one seed against every candidate, as a float array.
+
+    Each entry is the share of keypoints without a good cross-checked match.
+    """
+    owners, distances = cross_check_batch(seed_des, candidates)
+    good = distances < distance_threshold
+    count = np.bincount(owners[good], minlength=len(candidates))
+    seed_rows = 0 if seed_des is None else len(seed_des)
+    lengths = np.array([0 if des is None else len(des) for des in candidates])
+    smaller = np.minimum(seed_rows, lengths)
+    return np.where(smaller > 0, 1.0 - count / np.maximum(smaller, 1), 1.0)
+
+def cache_features(image_folder, cache_path, num_images=None, workers=1):
+    """Load the feature store at cache_path and bring it up to date with the folder.
+
+    Only images that are new or changed since the last run are extracted.
+    """
+    features_cache = FeatureStore(cache_path)
 
     images = sorted([os.path.join(image_folder, img) for img in os.listdir(image_folder) if img.endswith('.png')])
 
@@ -52,19 +182,39 @@ def cache_features(image_folder, cache_path, num_images=None):
         images = images[:num_images]
         print(f"Processing {len(images)} images.")
 
-    for image_path in tqdm(images, desc="Caching features"):
-        if image_path not in features_cache:
-            features_cache[image_path] = extract_features(image_path)
-
-    with open(cache_path, 'wb') as f:
-        pickle.dump(features_cache, f)
+    extracted = features_cache.update(images, workers)
+    print(f"Extracted features for {extracted} images, {len(features_cache) - extracted} loaded from cache")
 
     return features_cache
 
-def iterative_sorting(image_folder, cache_path, num_iterations=3, window_size=10):
-    features_cache = cache_features(image_folder, cache_path)
+def sort_with_index(seed_image_path, features_cache, top_k=10, refine_seconds=10.0):
+    """Order images along a short path through their k-NN similarity graph.
+
+    Each image's top_k perceptual-hash neighbours are re-ranked once with
+    exact ORB matching to build the graph. The path starts at the seed,
+    chains greedy nearest neighbours and is then refined with 2-opt/Or-opt
+    moves for up to refine_seconds (see sequence_order.py).
+    """
+    images = list(features_cache.keys())
+    hashes = [features_cache.hash(image_path) for image_path in images]
+
+    def rerank(node, candidates):
+        return match_distance_batch(features_cache[images[node]],
+                                    [features_cache[images[candidate]] for candidate in candidates])
+
+    graph = build_knn_graph(hashes, top_k, rerank)
+    print(f"Built k-NN graph with {len(images) * graph.neighbors.shape[1]} ORB comparisons")
+    path = order_sequence(graph, images.index(seed_image_path), refine_seconds)
+    return [images[i] for i in path]
+
+def iterative_sorting(image_folder, cache_path, num_iterations=3, window_size=10, method="index", top_k=10,
+                      refine_seconds=10.0, num_images=None, workers=1):
+    features_cache = cache_features(image_folder, cache_path, num_images, workers)
     images = list(features_cache.keys())
     seed_image_path = images[0]  # Initial seed
+
+    if method == "index":
+        return sort_with_index(seed_image_path, features_cache, top_k, refine_seconds)
     
     sorted_images = sort_using_cache(seed_image_path, features_cache)
 
@@ -86,37 +236,51 @@ def sort_using_cache(seed_image_path, features_cache, specific_images=None):
     else:
         images = list(features_cache.keys())
 
-    scores = []
-    for index, image_path in enumerate(images):
-        img_features = features_cache[image_path]
-        seed_index = images.index(seed_image_path)
-        similarity = compute_similarity(seed_features, img_features, seed_index, index)
-        scores.append((image_path, similarity))
+    seed_index = images.index(seed_image_path)
+    similarities = compute_similarity_batch(seed_features, [features_cache[image_path] for image_path in images],
+                                            seed_index, np.arange(len(images)))
+    scores = list(zip(images, similarities.tolist()))
 
     sorted_images = sorted(scores, key=lambda x: x[1], reverse=True)
     return [img[0] for img in sorted_images]
 
-def main(image_folder, output_folder, num_iterations=3, window_size=10, num_images=None):
+def main(image_folder, output_folder, num_iterations=3, window_size=10, num_images=None, method="index", top_k=10,
+         refine_seconds=10.0, workers=1, output_mode="copy", frame_rate=24):
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    cache_path = os.path.join(image_folder, "features_cache.pkl")
+    # Written as features_cache.<generation>.npy (descriptors) and features_cache.json (index)
+    cache_path = os.path.join(image_folder, "features_cache")
     
-    sorted_image_paths = iterative_sorting(image_folder, cache_path, num_iterations, window_size)
+    sorted_image_paths = iterative_sorting(image_folder, cache_path, num_iterations, window_size, method, top_k,
+                                           refine_seconds, num_images, workers)
+
+    write_output(sorted_image_paths, output_folder, output_mode, frame_rate)
 
-    print("Copying and renaming the images based on similarity...")
-    for idx, image_path in tqdm(enumerate(sorted_image_paths)):
-        copy_and_rename(image_path, idx, output_folder)
-    
     print("done.")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Sort images based on similarity")
     parser.add_argument("image_folder", help="Path to the input folder containing images")
     parser.add_argument("output_folder", help="Path to the output folder for sorted images")
-    parser.add_argument("--num-iterations", type=int, default=3, help="Number of iterations for refining sort")
-    parser.add_argument("--window-size", type=int, default=10, help="Window size for refining sort")
+    parser.add_argument("--method", choices=SORT_METHODS, default="index",
+                        help="index: shortest path through a k-NN graph built from a perceptual-hash index; "
+                             "window: the original seed sort with windowed refinement (default: index)")
+    parser.add_argument("--top-k", type=int, default=10,
+                        help="Neighbours per image in the k-NN graph, re-ranked with exact ORB matching (default: 10)")
+    parser.add_argument("--refine-seconds", type=float, default=10.0,
+                        help="Time budget for 2-opt/Or-opt refinement of the path (default: 10)")
+    parser.add_argument("--num-iterations", type=int, default=3, help="Number of iterations for refining sort (window method)")
+    parser.add_argument("--window-size", type=int, default=10, help="Window size for refining sort (window method)")
     parser.add_argument("--num-images", type=int, help="Number of images to process (optional)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes for feature extraction; 0 uses every core (default: 1)")
+    parser.add_argument("--output-mode", choices=OUTPUT_MODES, default="copy",
+                        help="How frames reach the output folder. hardlink/symlink/reflink fall back to a copy where "
+                             "unsupported; auto tries reflink then hardlink. manifest writes order.txt and concat "
+                             "writes order.ffconcat instead of any frames (default: copy)")
+    parser.add_argument("--frame-rate", type=float, default=24,
+                        help="Frame rate for --output-mode concat (default: 24)")
 
     args = parser.parse_args()
 
@@ -126,4 +290,6 @@ if __name__ == "__main__":
     window_size = args.window_size
     num_images = args.num_images
 
-    main(image_folder, output_folder, num_iterations, window_size, num_images)
\ No newline at end of file
+    main(image_folder, output_folder, num_iterations, window_size, num_images, args.method, args.top_k,
+         args.refine_seconds, args.workers if args.workers > 0 else os.cpu_count(), args.output_mode,
+         args.frame_rate)
\ No newline at end of file
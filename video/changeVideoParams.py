@@ -1,78 +1,270 @@
 import subprocess
 import argparse
+import glob
+import json
 import os
+import shlex
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def speed_up_video(input_video_path, output_video_path, speedup_factor):
-    command = [
-        'ffmpeg',
-        '-i', input_video_path,
-        '-filter:v', f"setpts={1/speedup_factor}*PTS",
-        output_video_path
-    ]
-    subprocess.run(command)
-
-def resize_video(input_video_path, output_video_path, resolution):
-    command = [
-        'ffmpeg',
-        '-i', input_video_path,
-        '-vf', f'scale={resolution[0]}:{resolution[1]}:force_original_aspect_ratio=decrease,crop={resolution[0]}:{resolution[1]}',
-        output_video_path
-    ]
-    subprocess.run(command)
-
-def change_codec_and_bitrate(input_video_path, output_video_path, codec='libx264', bitrate='192k'):
-    command = [
-        'ffmpeg',
-        '-i', input_video_path,
-        '-vcodec', codec,
-        '-b:v', bitrate,
-        output_video_path
-    ]
-    subprocess.run(command)
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.mkv', '.avi', '.webm', '.m4v', '.mpg', '.mpeg')
+OUTPUT_SUFFIX = "_processed.mp4"
 
-if __name__ == "__main__":
+def atempo_chain(speed):
+    """atempo filters whose product is speed; each stage is limited to 0.5-2.0."""
+    stages = []
+    while speed > 2.0:
+        stages.append(2.0)
+        speed /= 2.0
+    while speed < 0.5:
+        stages.append(0.5)
+        speed /= 0.5
+    stages.append(speed)
+    return ",".join(f"atempo={stage:.6g}" for stage in stages)
+
+def video_filters(speed=1.0, resolution=None):
+    """Filter chain for the video stream: retime, then scale to fill and crop to the exact size."""
+    filters = []
+    if speed != 1.0:
+        filters.append(f"setpts=PTS/{speed:.6g}")
+    if resolution:
+        width, height = resolution
+        filters.append(f"scale={width}:{height}:force_original_aspect_ratio=increase")
+        filters.append(f"crop={width}:{height}")
+        filters.append("setsar=1")
+    return ",".join(filters)
+
+def audio_filters(speed=1.0):
+    return atempo_chain(speed) if speed != 1.0 else ""
+
+def build_command(input_video_path, output_video_path, speed=1.0, resolution=None, codec='libx264', bitrate='192k',
+                  ffmpeg='ffmpeg', threads=None, progress=False, overwrite=False):
+    """One ffmpeg command that retimes, resizes and re-encodes in a single decode/encode pass.
+
+    Audio gets matching atempo filters so it stays in sync; inputs without
+    audio are fine, the audio filter just has nothing to apply to. With
+    progress=True ffmpeg reports key=value progress on stdout and only
+    errors on stderr, for running several jobs side by side. An existing
+    output is only replaced with overwrite=True; otherwise ffmpeg refuses.
+    """
+    command = [ffmpeg, '-hide_banner', '-y' if overwrite else '-n']
+    if progress:
+        command += ['-loglevel', 'error', '-nostats', '-progress', 'pipe:1']
+    command += ['-i', input_video_path]
+    vf = video_filters(speed, resolution)
+    if vf:
+        command += ['-filter:v', vf]
+    af = audio_filters(speed)
+    if af:
+        command += ['-filter:a', af]
+    command += ['-c:v', codec, '-b:v', bitrate]
+    if threads:
+        command += ['-threads', str(threads)]
+    command.append(output_video_path)
+    return command
+
+def expand_inputs(patterns):
+    """Video files from a mix of file paths, directories and glob patterns, without duplicates.
+
+    Outputs of this script (and unfinished .part files) are never picked up
+    as inputs, so the output directory can be the input directory.
+    """
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(os.path.join(pattern, f) for f in os.listdir(pattern)
+                             if f.lower().endswith(VIDEO_EXTENSIONS))
+        else:
+            matches = sorted(glob.glob(pattern)) or [pattern]
+        files += [os.path.normpath(f) for f in matches if not f.endswith((OUTPUT_SUFFIX, ".part.mp4"))]
+    return list(dict.fromkeys(files))
+
+def output_path_for(input_video_path, output_dir=None):
+    """<output_dir or input dir>/<input name>_processed.mp4"""
+    input_filename = os.path.splitext(os.path.basename(input_video_path))[0]
+    output_directory = output_dir if output_dir else os.path.dirname(input_video_path)
+    return os.path.join(output_directory, input_filename + OUTPUT_SUFFIX)
+
+def sidecar_path(output_video_path):
+    """Hidden file next to an output recording what it was made from."""
+    directory, name = os.path.split(output_video_path)
+    return os.path.join(directory, f".{name}.params.json")
+
+def job_signature(input_video_path, params):
+    stat = os.stat(input_video_path)
+    return dict(params, input=os.path.abspath(input_video_path), input_mtime_ns=stat.st_mtime_ns,
+                input_size=stat.st_size)
+
+def is_up_to_date(output_video_path, signature):
+    """True if the output exists and was made from the same input with the same parameters."""
+    if not os.path.exists(output_video_path):
+        return False
+    try:
+        with open(sidecar_path(output_video_path)) as f:
+            return json.load(f) == signature
+    except (OSError, ValueError):
+        return False
+
+def run_job(input_video_path, output_video_path, params, signature, threads=None):
+    """Encode one file into a temporary .part.mp4 and move it into place when ffmpeg succeeds.
+
+    Returns (frames encoded, seconds taken, error message or None).
+    """
+    temp_path = output_video_path[:-len(".mp4")] + ".part.mp4"
+    command = build_command(input_video_path, temp_path, params["speed"], params["size"], params["codec"],
+                            params["bitrate"], threads=threads, progress=True, overwrite=True)
+    start = time.perf_counter()
+    result = subprocess.run(command, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+
+    if result.returncode != 0:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        error = result.stderr.strip().splitlines()
+        return 0, elapsed, error[-1] if error else f"ffmpeg exit code {result.returncode}"
+
+    frames = 0
+    for line in result.stdout.splitlines():
+        if line.startswith("frame="):
+            frames = int(line.split("=", 1)[1] or 0)
+    os.replace(temp_path, output_video_path)
+    with open(sidecar_path(output_video_path), "w") as f:
+        json.dump(signature, f)
+    return frames, elapsed, None
+
+def plan_concurrency(jobs=0, threads=0, cores=None):
+    """Concurrent ffmpeg jobs and -threads per job.
+
+    Encoders stop scaling well past a handful of threads per stream, so by
+    default each job gets about 4 threads and the cores are shared out
+    between as many jobs as that allows.
+    """
+    cores = cores or os.cpu_count() or 1
+    if not jobs:
+        jobs = max(1, cores // (threads or 4))
+    if not threads:
+        threads = max(1, cores // jobs)
+    return jobs, threads
+
+def run_batch(input_paths, output_dir, params, jobs=0, threads=0, force=False, dry_run=False, overwrite=False):
+    """Transcode many files with a bounded number of ffmpeg processes running at once.
+
+    Files whose output already exists with matching parameters are skipped,
+    so an interrupted batch can simply be run again. Existing outputs without
+    a sidecar were not written by this script and are left alone unless
+    overwrite is set. Returns the number of failed jobs.
+    """
+    jobs, threads = plan_concurrency(jobs, threads)
+    pending = []
+    skipped = 0
+    kept = 0
+    for input_video_path in input_paths:
+        if not os.path.isfile(input_video_path):
+            print(f"Skipping {input_video_path}: not a file")
+            continue
+        output_video_path = output_path_for(input_video_path, output_dir)
+        signature = job_signature(input_video_path, params)
+        if not force and is_up_to_date(output_video_path, signature):
+            skipped += 1
+            continue
+        if not overwrite and os.path.exists(output_video_path) and not os.path.exists(sidecar_path(output_video_path)):
+            print(f"Skipping {input_video_path}: {output_video_path} already exists (use --overwrite to replace it)")
+            kept += 1
+            continue
+        pending.append((input_video_path, output_video_path, signature))
+
+    print(f"{len(pending)} to process, {skipped} already up to date, {kept} existing outputs kept; "
+          f"running {jobs} at a time with {threads} threads each")
+    if dry_run:
+        for input_video_path, output_video_path, _ in pending:
+            print(shlex.join(build_command(input_video_path, output_video_path, params["speed"], params["size"],
+                                           params["codec"], params["bitrate"], threads=threads, overwrite=True)))
+        return 0
+
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    total_bytes = sum(os.path.getsize(job[0]) for job in pending)
+    done_bytes = 0
+    failed = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(run_job, input_video_path, output_video_path, params, signature, threads):
+                   (input_video_path, output_video_path)
+                   for input_video_path, output_video_path, signature in pending}
+        for done, future in enumerate(as_completed(futures), 1):
+            input_video_path, output_video_path = futures[future]
+            frames, elapsed, error = future.result()
+            done_bytes += os.path.getsize(input_video_path)
+            # Remaining work is estimated from input size at the throughput so far
+            wall = time.perf_counter() - start
+            eta = wall * (total_bytes - done_bytes) / done_bytes if done_bytes else 0
+            if error:
+                failed += 1
+                status = f"FAILED: {error}"
+            else:
+                status = f"{frames} frames in {elapsed:.1f}s ({frames / max(elapsed, 1e-9):.1f} fps)"
+            print(f"[{done}/{len(pending)}] {os.path.basename(input_video_path)}: {status}, ETA {eta:.0f}s")
+
+    print(f"Processed {len(pending) - failed} files ({failed} failed) in {time.perf_counter() - start:.1f}s")
+    return failed
+
+def main():
     parser = argparse.ArgumentParser(description="Video Processing Script")
-    parser.add_argument("--input_video", required=True, help="Input video file path")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input_video", help="Input video file path")
+    source.add_argument("--inputs", nargs="+", metavar="PATH",
+                        help="Batch mode: video files, directories and/or glob patterns (quote globs)")
     parser.add_argument("--output_dir", help="Output directory for processed video. Default is the same as input directory.")
     parser.add_argument("--video_speed", type=float, default=1.0, help="Speed factor for the video (e.g., 2.0 for 2x speed)")
     parser.add_argument("--video_size", required=True, nargs=2, type=int, metavar=("WIDTH", "HEIGHT"), help="Output video size as WIDTH HEIGHT")
     parser.add_argument("--codec", default="libx264", help="Video codec (default: libx264)")
     parser.add_argument("--bitrate", default="192k", help="Video bitrate (default: 192k)")
+    parser.add_argument("--jobs", type=int, default=0,
+                        help="Batch mode: ffmpeg processes to run at once; 0 sizes it from the core count (default: 0)")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="Batch mode: ffmpeg -threads per job; 0 shares the cores between jobs (default: 0)")
+    parser.add_argument("--force", action="store_true",
+                        help="Batch mode: re-encode even when an output with matching parameters exists")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="Replace existing output files; without it they are reported and left alone")
+    parser.add_argument("--dry-run", action="store_true", help="Print the ffmpeg command instead of running it")
     args = parser.parse_args()
 
-    # Input video path
-    input_video_path = args.input_video
-
-    # Get the input video filename without extension
-    input_filename = os.path.splitext(os.path.basename(input_video_path))[0]
-
-    # Determine the output directory
-    if args.output_dir:
-        output_directory = args.output_dir
-    else:
-        # Use the same directory as the input video
-        output_directory = os.path.dirname(input_video_path)
-
-    # Create the output filename with "_processed" suffix
-    output_filename = f"{input_filename}_processed.mp4"
-
-    # Output video path
-    output_video_path = os.path.join(output_directory, output_filename)
+    params = {"speed": args.video_speed, "size": args.video_size, "codec": args.codec, "bitrate": args.bitrate}
 
-    # Apply transformations
-    temp_path1 = "temp1.mov"
-    temp_path2 = "temp2.mov"
+    if args.inputs:
+        input_paths = expand_inputs(args.inputs)
+        if not input_paths:
+            print("No input videos found")
+            sys.exit(1)
+        failed = run_batch(input_paths, args.output_dir, params, args.jobs, args.threads, args.force, args.dry_run,
+                           args.overwrite)
+        sys.exit(1 if failed else 0)
 
-    # Speed up the video
-    speed_up_video(input_video_path, temp_path1, args.video_speed)
+    # Input video path
+    input_video_path = args.input_video
 
-    # Resize the video
-    resize_video(temp_path1, temp_path2, args.video_size)
+    # Output goes next to the input unless --output_dir is given, with a "_processed" suffix
+    output_video_path = output_path_for(input_video_path, args.output_dir)
 
-    # Change codec and bitrate
-    change_codec_and_bitrate(temp_path2, output_video_path, args.codec, args.bitrate)
+    # Speed, size, codec and bitrate are applied in one pass
+    command = build_command(input_video_path, output_video_path, args.video_speed, args.video_size, args.codec,
+                            args.bitrate, overwrite=args.overwrite)
+    if os.path.exists(output_video_path) and not args.overwrite:
+        print(f"{output_video_path} already exists; use --overwrite to replace it")
+        sys.exit(1)
+    if args.dry_run:
+        print(shlex.join(command))
+        return
 
-    # Optional: Remove temporary files
-    subprocess.run(['rm', temp_path1, temp_path2])
+    result = subprocess.run(command)
+    if result.returncode != 0:
+        print(f"ffmpeg failed with exit code {result.returncode}")
+        sys.exit(result.returncode)
 
     print(f"Processed video saved to {output_video_path}")
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,141 @@
-import cv2
 import os
 from PIL import Image
 import numpy as np
 import subprocess
 import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from segment_encode import segmented_encode
 
-def create_video(image_files, video_path, fps, alpha_color=(255, 255, 255)):
+def load_frame(image_path, size=None):
+    """Decode an image to an RGB or RGBA uint8 array, resized to size if it differs."""
+    with Image.open(image_path) as img:
+        has_alpha = img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+        img = img.convert("RGBA" if has_alpha else "RGB")
+        if size and img.size != size:
+            img = img.resize(size)
+        return np.asarray(img)
+
+def prefetch_frames(image_files, size, workers=4):
+    """Yield decoded frames in order while up to 2 * workers more decode on a thread pool.
+
+    PIL releases the GIL while decoding, so threads overlap decoding with
+    blending and encoding.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for image_path in image_files:
+            pending.append(executor.submit(load_frame, image_path, size))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+class AlphaFlattener:
+    """Composite RGBA frames over a solid colour into one reusable RGB buffer.
+
+    out = (rgb * a + background * (255 - a)) / 255, rounded, in uint16
+    arithmetic; the background term and all scratch arrays are made once.
+    """
+
+    def __init__(self, height, width, color):
+        shape = (height, width, 3)
+        self.background = np.empty(shape, dtype=np.uint16)
+        self.background[:] = np.array(color, dtype=np.uint16)
+        self.alpha = np.empty((height, width, 1), dtype=np.uint16)
+        self.acc = np.empty(shape, dtype=np.uint16)
+        self.tmp = np.empty(shape, dtype=np.uint16)
+        self.out = np.empty(shape, dtype=np.uint8)
+
+    def flatten(self, rgba):
+        np.copyto(self.alpha, rgba[:, :, 3:])
+        np.multiply(rgba[:, :, :3], self.alpha, out=self.acc)
+        np.subtract(255, self.alpha, out=self.alpha)
+        np.multiply(self.background, self.alpha, out=self.tmp)
+        self.acc += self.tmp
+        # Exact round(x / 255) for x < 2**16: (x + 128 + ((x + 128) >> 8)) >> 8
+        self.acc += 128
+        np.right_shift(self.acc, 8, out=self.tmp)
+        self.acc += self.tmp
+        self.acc >>= 8
+        np.copyto(self.out, self.acc, casting="unsafe")
+        return self.out
+
+def raw_input_args(width, height, fps):
+    return ['-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-framerate', str(fps)]
+
+def encoder_args(width, height, crf=20, preset="medium", pix_fmt="yuv420p", codec="libx264"):
+    args = ['-c:v', codec, '-crf', str(crf), '-preset', preset, '-pix_fmt', pix_fmt]
+    if pix_fmt.startswith(("yuv420", "yuvj420", "nv12")) and (width % 2 or height % 2):
+        # 4:2:0 chroma needs even dimensions; pad by one pixel rather than fail
+        args += ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2']
+    return args
+
+def ffmpeg_command(video_path, width, height, fps, crf=20, preset="medium", pix_fmt="yuv420p", codec="libx264"):
+    """ffmpeg reading raw RGB frames from stdin and encoding them once."""
+    return (['ffmpeg', '-y', '-loglevel', 'error'] + raw_input_args(width, height, fps) + ['-i', '-']
+            + encoder_args(width, height, crf, preset, pix_fmt, codec) + [video_path])
+
+def create_video(image_files, video_path, fps, alpha_color=(255, 255, 255), crf=20, preset="medium",
+                 pix_fmt="yuv420p", codec="libx264", workers=4):
+    """Encode images straight to the final video in one pass.
+
+    Frames are decoded ahead on a thread pool, flattened against alpha_color
+    if they have transparency, and piped to ffmpeg as raw RGB. Frames whose
+    size differs from the first image are resized to match.
+    """
     # Determine the width and height from the first image
-    frame = Image.open(image_files[0])
-    frame = frame.convert("RGBA")
-    frame = Image.alpha_composite(Image.new("RGBA", frame.size, alpha_color), frame)
-    frame = cv2.cvtColor(np.array(frame), cv2.COLOR_RGBA2BGR)
+    with Image.open(image_files[0]) as first:
+        width, height = first.size
+
+    flattener = AlphaFlattener(height, width, alpha_color)
+    process = subprocess.Popen(ffmpeg_command(video_path, width, height, fps, crf, preset, pix_fmt, codec),
+                               stdin=subprocess.PIPE)
+    written = 0
+    try:
+        for frame in prefetch_frames(image_files, (width, height), workers):
+            if frame.shape[2] == 4:
+                frame = flattener.flatten(frame)
+            process.stdin.write(memoryview(np.ascontiguousarray(frame)).cast("B"))
+            written += 1
+    except BrokenPipeError:
+        pass
+    finally:
+        process.stdin.close()
+        returncode = process.wait()
 
-    height, width, channels = frame.shape
+    if returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with code {returncode} after {written} frames")
+    return written
 
-    # Define the codec and create a VideoWriter object
-    video = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'H264'), fps, (width, height))
+def create_video_segmented(image_files, video_path, fps, alpha_color=(255, 255, 255), crf=20, preset="medium",
+                           pix_fmt="yuv420p", codec="libx264", segment_frames=600, gop=120, jobs=0,
+                           benchmark=False):
+    """Encode GOP-aligned chunks of the sequence concurrently and join them losslessly.
 
-    for image in image_files:
-        img = Image.open(image)
-        img = img.convert("RGBA")
-        img = Image.alpha_composite(Image.new("RGBA", img.size, alpha_color), img)
-        img = cv2.cvtColor(np.array(img), cv2.COLOR_RGBA2BGR)
-        video.write(img)
+    Each chunk decodes its own frames with its own flattener; the cores are
+    shared out between the chunk encoders through -threads.
+    """
+    with Image.open(image_files[0]) as first:
+        width, height = first.size
+    jobs = jobs or os.cpu_count() or 1
+    threads = max(1, (os.cpu_count() or 1) // jobs)
 
-    video.release()
+    def reader():
+        flattener = AlphaFlattener(height, width, alpha_color)
 
-def reencode_video(input_video_path, output_video_path, crf):
-    # Use ffmpeg to re-encode the video with VBR and overwrite if the output file already exists
-    command = ['ffmpeg', '-y', '-i', input_video_path, '-vcodec', 'libx264', '-crf', str(crf), output_video_path]
-    subprocess.run(command, check=True)
+        def read(index):
+            frame = load_frame(image_files[index], (width, height))
+            if frame.shape[2] == 4:
+                frame = flattener.flatten(frame)
+            return memoryview(np.ascontiguousarray(frame)).cast("B")
+        return read
 
-    # After re-encoding, delete the original video file
-    if os.path.exists(input_video_path):  # always good to check if file exists before trying to delete
-        os.remove(input_video_path)
+    # The benchmark baseline encodes as create_video does, with every core
+    args = encoder_args(width, height, crf, preset, pix_fmt, codec)
+    segmented_encode(len(image_files), reader, raw_input_args(width, height, fps), args + ['-threads', str(threads)],
+                     video_path, segment_frames, gop, jobs, benchmark, baseline_args=args)
+    return len(image_files)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Image to Video Conversion Script")
@@ -43,21 +145,39 @@ if __name__ == "__main__":
     parser.add_argument("--framerate", type=float, default=13.0, help="Framerate for the output video (default: 13.0)")
     parser.add_argument("--alpha_color", nargs=3, type=int, default=[255, 255, 255], help="Alpha color as RGB values (default: 255 255 255)")
     parser.add_argument("--crf", type=int, default=20, help="Constant Rate Factor (CRF) for video encoding (default: 20)")
+    parser.add_argument("--preset", default="medium", help="Encoder preset, e.g. veryfast or slow (default: medium)")
+    parser.add_argument("--pix_fmt", default="yuv420p", help="Output pixel format (default: yuv420p)")
+    parser.add_argument("--codec", default="libx264", help="Video codec (default: libx264)")
+    parser.add_argument("--workers", type=int, default=4, help="Threads decoding images ahead of the encoder (default: 4)")
+    parser.add_argument("--segment-frames", type=int, default=0,
+                        help="Encode chunks of about this many frames in parallel and join them; 0 encodes in one "
+                             "process (default: 0)")
+    parser.add_argument("--gop", type=int, default=120,
+                        help="Keyframe interval when segmenting; chunks are a whole number of GOPs (default: 120)")
+    parser.add_argument("--jobs", type=int, default=0,
+                        help="Chunks encoded at once when segmenting; 0 uses every core (default: 0)")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="When segmenting, also time a single-process encode and report the speedup")
     args = parser.parse_args()
 
     # Input image folder
     image_folder = args.input_dir
     image_files = sorted([os.path.join(image_folder, img) for img in os.listdir(image_folder) if img.endswith(".png")])
+    if not image_files:
+        raise SystemExit(f"No .png images found in {image_folder}")
 
     # Output video path
     output_video_path = os.path.join(args.output_dir, args.output_video_name)
 
-    # Create the video
-    create_video(image_files, output_video_path, args.framerate, alpha_color=args.alpha_color)
-    
-    print("done with first pass")
+    # Create the video in a single encode, or in parallel chunks joined without re-encoding
+    if args.segment_frames:
+        frames = create_video_segmented(image_files, output_video_path, args.framerate, alpha_color=args.alpha_color,
+                                        crf=args.crf, preset=args.preset, pix_fmt=args.pix_fmt, codec=args.codec,
+                                        segment_frames=args.segment_frames, gop=args.gop, jobs=args.jobs,
+                                        benchmark=args.benchmark)
+    else:
+        frames = create_video(image_files, output_video_path, args.framerate, alpha_color=args.alpha_color,
+                              crf=args.crf, preset=args.preset, pix_fmt=args.pix_fmt, codec=args.codec,
+                              workers=args.workers)
 
-    # Re-encode the video
-    reencode_video(output_video_path, output_video_path.replace(".mp4", "_encoded.mp4"), args.crf)
-    
-    print("re-encoded video complete")
+    print(f"Wrote {frames} frames to {output_video_path}")
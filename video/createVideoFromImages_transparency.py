@@ -1,40 +1,124 @@
 import os
+import math
 import imageio.v2 as imageio
 from tqdm import tqdm
 import subprocess
-import shutil
 import tempfile
 import argparse
+import numpy as np
+from segment_encode import segmented_encode
 
-def create_video(image_files, video_path, frame_rate=13):
-    # Create a temporary directory to store individual frames
-    temp_dir = tempfile.mkdtemp()
+MODES = ("pipe", "concat")
 
+def vp9_options(width, threads=0, tile_columns=None, row_mt=True, crf=10, bitrate="2M"):
+    """libvpx-vp9 settings for an alpha encode that keeps every core busy.
+
+    VP9 parallelises over tile columns (each at least 256 pixels wide, given
+    as log2) and, with row-mt, over rows within a tile.
+    """
+    threads = threads or os.cpu_count() or 1
+    if tile_columns is None:
+        tile_columns = max(0, min(6, int(math.log2(max(1, width // 256)))))
+    options = ['-c:v', 'libvpx-vp9',
+               '-pix_fmt', 'yuva420p',  # Use yuva420p pixel format for alpha channel
+               '-b:v', bitrate,  # Set video bitrate (adjust as needed)
+               '-crf', str(crf),  # Set constant rate factor (adjust as needed)
+               '-threads', str(threads),
+               '-tile-columns', str(tile_columns)]
+    if row_mt:
+        options += ['-row-mt', '1']
+    return options
+
+def create_video(image_files, video_path, frame_rate=13, threads=0, tile_columns=None, row_mt=True, crf=10,
+                 bitrate="2M"):
+    """Stream decoded RGBA frames to ffmpeg as rawvideo over a pipe.
+
+    Nothing is written to disk but the video, and there is no limit on the
+    number of frames. Every image must have the size of the first one.
+    """
+    height, width = imageio.imread(image_files[0], mode='RGBA').shape[:2]
+
+    ffmpeg_command = [
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', f'{width}x{height}',
+        '-framerate', str(frame_rate),
+        '-i', '-',
+    ] + vp9_options(width, threads, tile_columns, row_mt, crf, bitrate) + [video_path]
+
+    process = subprocess.Popen(ffmpeg_command, stdin=subprocess.PIPE)
     try:
-        # Read images and save them as individual frames
-        for i, image_file in enumerate(tqdm(image_files, desc="Reading images")):
+        for image_file in tqdm(image_files, desc="Encoding frames"):
             image = imageio.imread(image_file, mode='RGBA')
-            frame_path = os.path.join(temp_dir, f'frame_{i:04d}.png')
-            imageio.imwrite(frame_path, image)
+            if image.shape[:2] != (height, width):
+                raise ValueError(f"{image_file} is {image.shape[1]}x{image.shape[0]}, expected {width}x{height}")
+            process.stdin.write(np.ascontiguousarray(image).tobytes())
+    except BrokenPipeError:
+        pass
+    finally:
+        process.stdin.close()
+        returncode = process.wait()
+
+    if returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with code {returncode}")
+    print("done.")
 
-        # Use FFmpeg to create a video from the individual frames
-        # This example uses the WebM format with VP9 codec, preserving alpha channel
+def write_concat_list(image_files, list_path, frame_rate):
+    """ffconcat script listing the original files, each shown for one frame."""
+    with open(list_path, "w") as f:
+        f.write("ffconcat version 1.0\n")
+        for image_file in image_files:
+            escaped = os.path.abspath(image_file).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\nduration {1 / frame_rate:.6f}\n")
+
+def create_video_concat(image_files, video_path, frame_rate=13, threads=0, tile_columns=None, row_mt=True, crf=10,
+                        bitrate="2M"):
+    """Have ffmpeg read the original PNGs itself through the concat demuxer.
+
+    Only a small text list is written to a temporary file; frames are
+    decoded once, by ffmpeg.
+    """
+    height, width = imageio.imread(image_files[0], mode='RGBA').shape[:2]
+    fd, list_path = tempfile.mkstemp(suffix=".ffconcat")
+    os.close(fd)
+    try:
+        write_concat_list(image_files, list_path, frame_rate)
         ffmpeg_command = [
-            'ffmpeg', 
-            '-framerate', str(frame_rate),
-            '-i', os.path.join(temp_dir, 'frame_%04d.png'),
-            '-y',
-            '-c:v', 'libvpx-vp9',
-            '-pix_fmt', 'yuva420p',  # Use yuva420p pixel format for alpha channel
-            '-b:v', '2M',  # Set video bitrate (adjust as needed)
-            '-crf', '10',  # Set constant rate factor (adjust as needed)
-            video_path
-        ]
-        subprocess.run(ffmpeg_command)
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'concat', '-safe', '0', '-i', list_path,
+            '-r', str(frame_rate),
+        ] + vp9_options(width, threads, tile_columns, row_mt, crf, bitrate) + [video_path]
+        subprocess.run(ffmpeg_command, check=True)
     finally:
-        # Clean up the temporary directory
-        shutil.rmtree(temp_dir)
+        os.remove(list_path)
+
+    print("done.")
+
+def create_video_segmented(image_files, video_path, frame_rate=13, threads=0, tile_columns=None, row_mt=True, crf=10,
+                           bitrate="2M", segment_frames=600, gop=120, jobs=0, benchmark=False):
+    """Encode GOP-aligned chunks concurrently and join them without re-encoding.
+
+    libvpx-vp9 uses few threads well even with tiles and row-mt, so several
+    single-stream encoders side by side keep more cores busy. threads is per
+    chunk and defaults to the cores shared out between the jobs.
+    """
+    height, width = imageio.imread(image_files[0], mode='RGBA').shape[:2]
+    jobs = jobs or os.cpu_count() or 1
+    chunk_threads = threads or max(1, (os.cpu_count() or 1) // jobs)
+
+    def reader():
+        def read(index):
+            image = imageio.imread(image_files[index], mode='RGBA')
+            if image.shape[:2] != (height, width):
+                raise ValueError(f"{image_files[index]} is {image.shape[1]}x{image.shape[0]}, "
+                                 f"expected {width}x{height}")
+            return np.ascontiguousarray(image).tobytes()
+        return read
 
+    input_args = ['-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', f'{width}x{height}', '-framerate', str(frame_rate)]
+    segmented_encode(len(image_files), reader, input_args,
+                     vp9_options(width, chunk_threads, tile_columns, row_mt, crf, bitrate),
+                     video_path, segment_frames, gop, jobs, benchmark,
+                     baseline_args=vp9_options(width, threads, tile_columns, row_mt, crf, bitrate))
     print("done.")
 
 if __name__ == "__main__":
@@ -43,14 +127,45 @@ if __name__ == "__main__":
     parser.add_argument("--output_dir", required=True, help="Output directory for the video file")
     parser.add_argument("--output_video_name", required=True, help="Name of the output video file")
     parser.add_argument("--framerate", type=int, default=13, help="Framerate for the output video (default: 13)")
+    parser.add_argument("--mode", choices=MODES, default="pipe",
+                        help="pipe: decode here and stream raw RGBA to ffmpeg; "
+                             "concat: let ffmpeg read the PNGs from a concat list (default: pipe)")
+    parser.add_argument("--threads", type=int, default=0, help="libvpx-vp9 threads; 0 uses every core (default: 0)")
+    parser.add_argument("--tile-columns", type=int,
+                        help="log2 of VP9 tile columns (default: as many as the width allows, up to 6)")
+    parser.add_argument("--no-row-mt", dest="row_mt", action="store_false",
+                        help="Disable VP9 row-based multithreading")
+    parser.add_argument("--crf", type=int, default=10, help="Constant rate factor (default: 10)")
+    parser.add_argument("--bitrate", default="2M", help="Target video bitrate (default: 2M)")
+    parser.add_argument("--segment-frames", type=int, default=0,
+                        help="Encode chunks of about this many frames in parallel and join them; "
+                             "0 encodes in one process; pipe mode only (default: 0)")
+    parser.add_argument("--gop", type=int, default=120,
+                        help="Keyframe interval when segmenting; chunks are a whole number of GOPs (default: 120)")
+    parser.add_argument("--jobs", type=int, default=0,
+                        help="Chunks encoded at once when segmenting; 0 uses every core (default: 0)")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="When segmenting, also time a single-process encode and report the speedup")
     args = parser.parse_args()
+    if args.segment_frames and args.mode == "concat":
+        parser.error("--segment-frames needs --mode pipe; concat mode always encodes in a single ffmpeg process")
 
     # Input image folder
     image_folder = args.input_dir
     image_files = sorted([os.path.join(image_folder, img) for img in os.listdir(image_folder) if img.endswith(".png")])
+    if not image_files:
+        raise SystemExit(f"No .png images found in {image_folder}")
 
     # Output video path
     output_video_path = os.path.join(args.output_dir, args.output_video_name)
 
     # Create the video
-    create_video(image_files, output_video_path, args.framerate)
+    if args.segment_frames:
+        create_video_segmented(image_files, output_video_path, args.framerate, threads=args.threads,
+                               tile_columns=args.tile_columns, row_mt=args.row_mt, crf=args.crf, bitrate=args.bitrate,
+                               segment_frames=args.segment_frames, gop=args.gop, jobs=args.jobs,
+                               benchmark=args.benchmark)
+    else:
+        encode = create_video_concat if args.mode == "concat" else create_video
+        encode(image_files, output_video_path, args.framerate, threads=args.threads, tile_columns=args.tile_columns,
+               row_mt=args.row_mt, crf=args.crf, bitrate=args.bitrate)
@@ -1,45 +1,195 @@
 import cv2
 import numpy as np
 import os
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+METHODS = ("blend", "farneback", "dis")
+
+def blend_weights(num_frames):
+    """Fixed-point (x/256) weights of B for the frames strictly between A and B."""
+    return [int(round(256 * k / (num_frames + 1))) for k in range(1, num_frames + 1)]
+
+class Blender:
+    """Cross-fade two frames in uint16 fixed point without allocating per frame.
+
+    out = (A * (256 - w) + B * w + 128) >> 8 stays below 2**16 for 8-bit
+    input, so every step runs in place on buffers made once per frame size.
+    """
+
+    def __init__(self, shape):
+        self.a = np.empty(shape, dtype=np.uint16)
+        self.b = np.empty(shape, dtype=np.uint16)
+        self.acc = np.empty(shape, dtype=np.uint16)
+        self.tmp = np.empty(shape, dtype=np.uint16)
+        self.out = np.empty(shape, dtype=np.uint8)
+
+    def load(self, A, B):
+        np.copyto(self.a, A)
+        np.copyto(self.b, B)
+
+    def blend(self, weight):
+        """Return the frame at weight/256 of the way from A to B (valid until the next call)."""
+        np.multiply(self.a, 256 - weight, out=self.acc)
+        np.multiply(self.b, weight, out=self.tmp)
+        self.acc += self.tmp
+        self.acc += 128
+        self.acc >>= 8
+        np.copyto(self.out, self.acc, casting="unsafe")
+        return self.out
 
 def interpolate_frames(A, B, num_frames):
     """
-    Returns a list of interpolated frames between A and B.
+    Returns a list of num_frames frames strictly between A and B (A and B themselves are not included).
+    """
+    blender = Blender(A.shape)
+    blender.load(A, B)
+    return [blender.blend(weight).copy() for weight in blend_weights(num_frames)]
+
+def compute_flow(A, B, method):
+    """Dense optical flow from A to B (BGR frames) as an (h, w, 2) float32 array."""
+    gray_a = cv2.cvtColor(A, cv2.COLOR_BGR2GRAY)
+    gray_b = cv2.cvtColor(B, cv2.COLOR_BGR2GRAY)
+    if method == "dis":
+        return cv2.DISOpticalFlow_create(cv2.DISOPTICAL_FLOW_PRESET_MEDIUM).calc(gray_a, gray_b, None)
+    return cv2.calcOpticalFlowFarneback(gray_a, gray_b, None, 0.5, 3, 15, 3, 5, 1.2, 0)
+
+def flow_frames(A, B, num_frames, method="farneback"):
+    """Motion-compensated in-between frames.
+
+    Flow is estimated both ways once per pair. For each t the flows from the
+    new frame back to A and on to B are approximated from those two
+    (F_t0 = -(1-t)t F_01 + t^2 F_10, F_t1 = (1-t)^2 F_01 - t(1-t) F_10),
+    both ends are warped there and cross-faded.
     """
+    flow_ab = compute_flow(A, B, method)
+    flow_ba = compute_flow(B, A, method)
+    h, w = A.shape[:2]
+    grid = np.dstack(np.meshgrid(np.arange(w, dtype=np.float32), np.arange(h, dtype=np.float32)))
+    to_a = np.empty_like(grid)
+    to_b = np.empty_like(grid)
+    blender = Blender(A.shape)
+
     frames = []
-    for t in np.linspace(0, 1, num_frames):
-        interpolated_frame = (1 - t) * A + t * B
-        frames.append(interpolated_frame.astype(np.uint8))
+    for weight in blend_weights(num_frames):
+        t = weight / 256
+        np.add(grid, -(1 - t) * t * flow_ab + t * t * flow_ba, out=to_a)
+        np.add(grid, (1 - t) * (1 - t) * flow_ab - t * (1 - t) * flow_ba, out=to_b)
+        warped_a = cv2.remap(A, to_a, None, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        warped_b = cv2.remap(B, to_b, None, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        blender.load(warped_a, warped_b)
+        frames.append(blender.blend(weight).copy())
     return frames
 
-def create_morph_video(image_folder, output_video_path, num_interpolated_frames=5):
+def flow_frames_task(args):
+    return flow_frames(*args)
+
+def read_frames(images):
+    """Yield each image once, decoded to BGR."""
+    for image_path in images:
+        frame = cv2.imread(image_path)
+        if frame is None:
+            raise ValueError(f"Could not read {image_path}")
+        yield frame
+
+def blended_sequence(images, num_frames):
+    """Yield every output frame for a linear cross-fade.
+
+    A rolling two-frame buffer means each image is decoded exactly once, and
+    blending reuses the same buffers for the whole video. Yielded arrays are
+    only valid until the next one is requested.
+    """
+    frames = read_frames(images)
+    A = next(frames)
+    blender = Blender(A.shape)
+    weights = blend_weights(num_frames)
+    yield A
+    for B in frames:
+        blender.load(A, B)
+        for weight in weights:
+            yield blender.blend(weight)
+        yield B
+        A = B
+
+def flow_sequence(images, num_frames, method, workers=1, max_in_flight=None):
+    """Yield every output frame with motion-compensated in-betweens.
+
+    Images are still decoded once, here; each (A, B) pair goes to a worker
+    process for flow and warping, with at most max_in_flight pairs pending
+    so memory stays bounded. Frames come back in order.
+    """
+    frames = read_frames(images)
+    A = next(frames)
+    yield A
+    if workers <= 1:
+        for B in frames:
+            yield from flow_frames(A, B, num_frames, method)
+            yield B
+            A = B
+        return
+
+    max_in_flight = max_in_flight or 2 * workers
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for B in frames:
+            pending.append((executor.submit(flow_frames_task, (A, B, num_frames, method)), B))
+            A = B
+            if len(pending) >= max_in_flight:
+                future, end = pending.popleft()
+                yield from future.result()
+                yield end
+        while pending:
+            future, end = pending.popleft()
+            yield from future.result()
+            yield end
+
+def create_morph_video(image_folder, output_video_path, num_interpolated_frames=5, method="blend", fps=30,
+                       fourcc="DIVX", workers=1):
     images = sorted([os.path.join(image_folder, img) for img in os.listdir(image_folder) if img.endswith('.png')])
     if not images:
         print("No images found!")
         return
 
-    # Define video writer
-    frame = cv2.imread(images[0])
+    if method == "blend":
+        sequence = blended_sequence(images, num_interpolated_frames)
+    else:
+        sequence = flow_sequence(images, num_interpolated_frames, method, workers)
+
+    # The first frame out is the first image, decoded once; it sizes the video writer
+    frame = next(sequence)
     h, w, layers = frame.shape
     size = (w,h)
-    out = cv2.VideoWriter(output_video_path, cv2.VideoWriter_fourcc(*'DIVX'), 30, size)
-    
-    for i in range(len(images)-1):
-        A = cv2.imread(images[i]).astype(float)
-        B = cv2.imread(images[i+1]).astype(float)
+    out = cv2.VideoWriter(output_video_path, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+    out.write(frame)
 
-        interpolated_frames = interpolate_frames(A, B, num_interpolated_frames)
+    # Each image appears once, followed by its in-betweens towards the next one
+    written = 1
+    for frame in sequence:
+        out.write(frame)
+        written += 1
+    out.release()
+    print(f"Wrote {written} frames ({len(images)} images, {num_interpolated_frames} in-betweens each) "
+          f"to {output_video_path}")
 
-        # Write the original frame A and the interpolated frames to the video
-        out.write(A.astype(np.uint8))
-        for frame in interpolated_frames:
-            out.write(frame)
+def main():
+    parser = argparse.ArgumentParser(description="Morph between a sorted sequence of images")
+    parser.add_argument("image_folder", help="Folder of .png images, in sorted order")
+    parser.add_argument("output_video", help="Path to the output video")
+    parser.add_argument("--frames", type=int, default=5,
+                        help="Interpolated frames between each pair of images (default: 5)")
+    parser.add_argument("--method", choices=METHODS, default="blend",
+                        help="blend: cross-fade; farneback/dis: motion-compensated with OpenCV optical flow "
+                             "(default: blend)")
+    parser.add_argument("--fps", type=float, default=30, help="Output frame rate (default: 30)")
+    parser.add_argument("--fourcc", default="DIVX", help="FourCC codec for cv2.VideoWriter (default: DIVX)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes for optical flow; 0 uses every core (default: 1)")
 
-    # Don't forget the last frame
-    out.write(B.astype(np.uint8))
-    out.release()
+    args = parser.parse_args()
+    workers = args.workers if args.workers > 0 else os.cpu_count()
+    create_morph_video(args.image_folder, args.output_video, args.frames, args.method, args.fps, args.fourcc,
+                       workers)
 
-# Example Usage:
-folder_path = "/path_to_sorted_images_folder/"
-video_path = "/path_to_save_video/video.avi"
-create_morph_video(folder_path, video_path)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Encode a long frame sequence as concurrent GOP-aligned chunks.
+
+The frame list is split into chunks that are a whole number of GOPs long.
+Each chunk is piped to its own ffmpeg process, with a bounded number running
+at once, and the chunk files are joined by the concat demuxer with stream
+copy, so stitching costs no quality. Callers pass a reader factory: each
+chunk calls it once and reads frames by index from what it returns, so
+readers may keep their own scratch buffers.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+def chunk_ranges(frame_count, chunk_frames, gop):
+    """(start, end) frame ranges, each a whole number of GOPs except possibly the last."""
+    chunk_frames = max(gop, (chunk_frames // gop) * gop)
+    return [(start, min(start + chunk_frames, frame_count)) for start in range(0, frame_count, chunk_frames)]
+
+
+def encode_range(reader_factory, start, end, input_args, output_args, path, stop=None):
+    """Pipe frames start..end-1 into one ffmpeg process. Returns (frames, seconds).
+
+    If the stop event is set, no more frames are sent and the encode is cut short.
+    """
+    command = ['ffmpeg', '-y', '-loglevel', 'error'] + input_args + ['-i', '-'] + output_args + [path]
+    began = time.perf_counter()
+    read_frame = reader_factory()
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    try:
+        for index in range(start, end):
+            if stop is not None and stop.is_set():
+                break
+            process.stdin.write(read_frame(index))
+    except BrokenPipeError:
+        pass
+    finally:
+        process.stdin.close()
+        returncode = process.wait()
+    if returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with code {returncode} encoding frames {start}-{end - 1}")
+    return end - start, time.perf_counter() - began
+
+
+def concat_copy(chunk_paths, video_path):
+    """Join encoded chunks without re-encoding."""
+    fd, list_path = tempfile.mkstemp(suffix=".ffconcat", dir=os.path.dirname(os.path.abspath(video_path)))
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write("ffconcat version 1.0\n")
+            for chunk_path in chunk_paths:
+                escaped = os.path.abspath(chunk_path).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_path,
+                        '-c', 'copy', video_path], check=True)
+    finally:
+        os.remove(list_path)
+
+
+def segmented_encode(frame_count, reader_factory, input_args, output_args, video_path, chunk_frames=600, gop=120,
+                     jobs=0, benchmark=False, baseline_args=None):
+    """Encode frames 0..frame_count-1 in parallel chunks and stitch them into video_path.
+
+    output_args must not name the output file; '-g gop' is added so every
+    chunk keeps the same keyframe cadence. The first chunk to fail cancels
+    the chunks not yet started and stops the running ones.
+
+    With benchmark=True the same frames are then encoded again by a single
+    process into a scratch file and the speedup is printed. That process
+    uses baseline_args (default output_args), which should be what the
+    unsegmented encode would use, without the per-chunk thread cap.
+    Returns the wall time in seconds.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    ranges = chunk_ranges(frame_count, chunk_frames, gop)
+    directory = os.path.dirname(os.path.abspath(video_path))
+    extension = os.path.splitext(video_path)[1] or ".mkv"
+    chunk_dir = tempfile.mkdtemp(prefix=".chunks_", dir=directory)
+    chunk_paths = [os.path.join(chunk_dir, f"chunk_{i:05d}{extension}") for i in range(len(ranges))]
+    output_args = output_args + ['-g', str(gop)]
+    stop = threading.Event()
+
+    print(f"Encoding {frame_count} frames as {len(ranges)} chunks, {min(jobs, len(ranges))} at a time")
+    began = time.perf_counter()
+    busy = 0.0
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(encode_range, reader_factory, start, end, input_args, output_args, path,
+                                       stop): number
+                       for number, ((start, end), path) in enumerate(zip(ranges, chunk_paths))}
+            for future in as_completed(futures):
+                number = futures[future]
+                start, end = ranges[number]
+                try:
+                    frames, seconds = future.result()
+                except BaseException:
+                    stop.set()
+                    for pending in futures:
+                        pending.cancel()
+                    raise
+                busy += seconds
+                print(f"  chunk {number + 1}/{len(ranges)} (frames {start}-{end - 1}): "
+                      f"{frames / max(seconds, 1e-9):.1f} fps")
+        concat_copy(chunk_paths, video_path)
+    finally:
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+
+    wall = time.perf_counter() - began
+    print(f"Encoded {frame_count} frames in {wall:.1f}s ({frame_count / max(wall, 1e-9):.1f} fps); "
+          f"chunks were busy {busy / max(wall, 1e-9):.1f}x the wall time")
+
+    if benchmark:
+        fd, scratch = tempfile.mkstemp(suffix=extension, dir=directory)
+        os.close(fd)
+        try:
+            baseline_args = output_args if baseline_args is None else baseline_args + ['-g', str(gop)]
+            _, single = encode_range(reader_factory, 0, frame_count, input_args, baseline_args, scratch)
+        finally:
+            os.remove(scratch)
+        print(f"Single process: {single:.1f}s ({frame_count / max(single, 1e-9):.1f} fps); "
+              f"segmented speedup {single / max(wall, 1e-9):.2f}x")
+    return wall